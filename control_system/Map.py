@@ -1,5 +1,8 @@
 import json
-from itertools import product
+
+import numpy as np
+
+MAX_TABLE_ACTIONS = 65536  # above this the phase codes of an action are decoded at every phase change
 
 inter = {
     'gneJ6': 3,
@@ -15,7 +18,15 @@ class Map:
 
         self.roads = info['roads']
         self.lane_groups = info['lane_groups']
-        self.states = self._build_actions(info['num_states'])
+
+        # an action is a mixed-radix number with one digit per intersection, the first one being the most significant
+        self.intersections = list(info['num_states'].keys())
+        self._phases = np.array(list(info['num_states'].values()), dtype=np.int64)
+        self._radix = np.append(np.cumprod(self._phases[:0:-1])[::-1], 1)
+        self.num_actions = int(np.prod(self._phases, dtype=np.float64))
+
+        # green phase codes of every action, only precomputed when the action space is small enough
+        self._green_codes = self._decode(np.arange(self.num_actions)) if self.num_actions <= MAX_TABLE_ACTIONS else None
 
     def _parse_file(self, filename):
 
@@ -24,72 +35,85 @@ class Map:
 
         return json.loads(content)
 
-    def _flatten(self, lis):
+    def _decode(self, actions):
 
         """
-		Transform a nested list to a 1D list 
+		Return the green phase code of every intersection for the given action numbers
 		"""
 
-        result = []
-        for item in lis:
-
-            if isinstance(item, list):
-                result = result + self._flatten(item)
-            else:
-                result.append(item)
-
-        return result
+        # we multiply by two because in the .net file odd values represent yellow phases
+        return (2 * (np.asarray(actions)[..., None] // self._radix % self._phases)).astype(np.int16)
 
-    def _build_actions(self, intersections):
+    def phase_codes(self, action):
 
         """
-		Return all possible actions
+		Return the green phase code of every intersection, in the order of intersections
 		"""
 
-        # First we generate all possible combinations
+        if self._green_codes is not None:
+            return self._green_codes[action]
+        return self._decode(action)
 
-        # we have to init the first value
+    def yellow_codes(self, old_action, action):
 
-        keys = list(intersections.keys())
+        """
+		Return the phase code of every intersection between two actions: the yellow phase following the old green one
+		for the intersections that change, the new green phase for the others
+		"""
 
-        num_states = intersections[keys[0]]
+        old_codes = self.phase_codes(old_action)
+        codes = self.phase_codes(action)
+        return np.where(old_codes != codes, old_codes + 1, codes)
 
-        # we multiply by two because in the .net file odd values represent yellow phases
-        result = list(map(lambda x: 2 * x, range(num_states)))
+    def action_to_state(self, action):
 
-        result = [[x] for x in result]
+        """
+		Return the phase code of each intersection for an action, as a dict
+		"""
 
-        # now we do the prodcut with other states if there are any
+        return dict(zip(self.intersections, self.phase_codes(action).tolist()))
 
-        for i in range(1, len(keys)):
+    def greedy_actions(self, q_values, branching=False):
 
-            new_result = []
+        """
+		Return the best action of each row of q-values: one argmax over all the actions, or with a branching network
+		one argmax per intersection head composed into the action number
+		"""
 
-            for res in result:
-                num_states = intersections[keys[i]]
+        q_values = np.asarray(q_values)
+        if not branching:
+            return q_values.argmax(axis=1)
 
-                states = list(map(lambda x: 2 * x, range(num_states)))
+        heads = np.split(q_values, np.cumsum(self._phases)[:-1], axis=1)
+        return np.stack([head.argmax(axis=1) for head in heads], axis=1) @ self._radix
 
-                prod = list(product([res], states))
-                prod = list(map(lambda x: list(x), prod))
+    def action_values(self, q_values, actions, branching=False):
 
-                new_result = new_result + prod
+        """
+		Return the q-value of the given action of each row, the mean of the values of its phases with a branching network
+		"""
 
-            result = new_result
+        q_values = np.asarray(q_values)
+        actions = np.asarray(actions)
+        if not branching:
+            return q_values[np.arange(len(actions)), actions]
 
-        result = list(map(lambda x: self._flatten(x), result))
+        heads = np.split(q_values, np.cumsum(self._phases)[:-1], axis=1)
+        digits = actions[:, None] // self._radix % self._phases
+        return np.mean([head[np.arange(len(actions)), digits[:, i]] for i, head in enumerate(heads)], axis=0)
 
-        # Now we build the dict
+    @property
+    def phases(self):
+        return self._phases.tolist()
 
-        for j, res in enumerate(result):
-            state = {}
-            for i in range(len(res)):
-                key = keys[i]
-                state[key] = res[i]
+    @property
+    def states(self):
 
-            result[j] = state
+        """
+		Return all possible actions, decoded on demand
+		"""
 
-        return result
+        return [self.action_to_state(action) for action in range(self.num_actions)]
 
 
 if __name__ == '__main__':
@@ -1,10 +1,15 @@
-import traci
-import numpy as np
+from sumo_backend import traci
+from traci import connection
+from traci.exceptions import FatalTraCIError
+import timeit
+
+from collector import Collector, WaitingTimeTracker
+from scheduler import DecisionScheduler
 
 
 class Simulation:
     def __init__(self, Model, Map_info, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states,
-                 num_actions):
+                 num_actions, reuse_sumo=False, early_termination=False, label=None, Scheduler=None, branching=False):
         self._Model = Model
         self._TrafficGen = TrafficGen
         self._step = 0
@@ -14,45 +19,126 @@ class Simulation:
         self._yellow_duration = yellow_duration
         self._num_states = num_states
         self._num_actions = num_actions
-
-        self._waiting_times = {}
-
-        self._all_cars_waiting_time = {}
+        self._reuse_sumo = reuse_sumo
+        self._early_termination = early_termination
+        self._label = label
+        self._branching = branching  # the model has one head of q-values per intersection
+        self._sumo_running = False
+        self._setup_time = 0
 
         self._map_info = Map_info
         self._Roads = self._map_info.roads
         self._lane_groups = self._map_info.lane_groups
 
-    def action_to_state(self, code):
-        return self._map_info.states[code]
+        self._Collector = Collector(self._map_info)
+        self._WaitingTimeTracker = WaitingTimeTracker(self._Collector)
+        self._Scheduler = Scheduler if Scheduler is not None else DecisionScheduler()  # by default every decision is taken
 
-    def _collect_waiting_times(self):
+    def _start_sumo(self):
         """
-        Retrieve the waiting time of every car in the incoming roads
+        Start sumo, or reload the new route file in the running instance when it is reused across episodes,
+        then register the subscriptions used to collect the metrics
         """
-        car_list = traci.vehicle.getIDList()
-        for car_id in car_list:
-            wait_time = traci.vehicle.getAccumulatedWaitingTime(car_id)
-            road_id = traci.vehicle.getRoadID(car_id)  # get the road id where the car is located
-            if road_id in self._Roads:  # consider only the waiting times of cars in incoming roads
-                self._all_cars_waiting_time[car_id] = wait_time
-                self._waiting_times[car_id] = wait_time
+        start_time = timeit.default_timer()
+
+        if self._reuse_sumo and self._sumo_running:
+            self.activate()
+            try:
+                traci.load(self._sumo_cmd[1:])
+            except (FatalTraCIError, OSError):
+                # libsumo runs sumo inside this process, there is no process to restart
+                if traci.name != 'traci':
+                    raise
+                print("SUMO is not responding, restarting it...")
+                self.close()
+
+        if not self._sumo_running:
+            if self._label is None:
+                traci.start(self._sumo_cmd)
             else:
-                if car_id in self._waiting_times:  # a car that was tracked has cleared the intersection
-                    del self._waiting_times[car_id]
-        total_waiting_time = sum(self._waiting_times.values())
-        return total_waiting_time
+                traci.start(self._sumo_cmd, label=self._label)
+            self._sumo_running = True
 
-    def _get_changed_actions(self, old_action_number, action_number):
+        self._TrafficGen.register_routes()  # only with direct injection, the cars of the episode then use them
+        self._Collector.subscribe()
+        self._WaitingTimeTracker.reset()
+        self._Scheduler.reset()
+        self._setup_time = round(timeit.default_timer() - start_time, 2)
 
-        changed = []
-        old_actions = self.action_to_state(old_action_number)
-        actions = self.action_to_state(action_number)
+    def activate(self):
+        """
+        Make the connection of this simulation the current one, when several sumo instances run side by side
+        """
+        if self._label is not None:
+            traci.switch(self._label)
 
-        for j in actions:
-            if actions[j] != old_actions[j]:
-                changed.append(j)
-        return changed
+    def _close_sumo(self):
+        """
+        Close sumo at the end of an episode, unless it is reused by the next one
+        """
+        if not self._reuse_sumo:
+            self.close()
+
+    def close(self):
+        """
+        Close the connection to sumo, also when the process has already died
+        """
+        if self._sumo_running:
+            self._sumo_running = False
+            try:
+                self.activate()
+                traci.close()
+            except (FatalTraCIError, OSError):
+                if traci.name == 'traci':
+                    self._drop_connection()
+
+    def _drop_connection(self):
+        """
+        Forget the traci connection of a sumo that could not be closed, traci keeps it registered under its label
+        and would refuse to start a new sumo with the same label
+        """
+        label = self._label if self._label is not None else 'default'
+        if not connection.has(label):
+            return
+
+        stale = connection.get(label)
+        if stale._process is not None:
+            stale._process.kill()
+        for key in [key for key, value in connection._connections.items() if value is stale]:
+            del connection._connections[key]
+
+    def _simulation_step(self):
+        """
+        Simulate 1 step in sumo and refresh the collected metrics, injecting first the cars due at this step
+        when the generator keeps them in memory (the simulation time is the step counter)
+        """
+        self._TrafficGen.inject(self._step)
+        traci.simulationStep()
+        self._Collector.update()
+
+    def _greedy_action(self, q_values):
+        """
+        Return the action with the highest predicted value, composed from the best phase of every intersection
+        when the model is branching
+        """
+        return self._map_info.greedy_actions(q_values, self._branching)[0]
+
+    def action_to_state(self, code):
+        return self._map_info.action_to_state(code)
+
+    def _collect_waiting_times(self):
+        """
+        Retrieve the waiting time of every car in the incoming roads
+        """
+        return self._WaitingTimeTracker.collect()
+
+    def _tail_is_empty(self):
+        """
+        Whether the rest of the episode can be skipped: the network is empty and no more cars will be inserted,
+        so every remaining step would have no queue, no waiting time and no emissions. Sumo does not know
+        the cars the generator has not injected yet
+        """
+        return self._early_termination and self._Collector.network_empty() and self._TrafficGen.pending == 0
 
     def _set_phase_and_simulate(self, old_action_number, action_number):
 
@@ -64,9 +150,7 @@ class Simulation:
             self._simulate(self._yellow_duration)
             phase_duration = self._green_duration - self._yellow_duration
 
-        coresp = self.action_to_state(action_number)
-        for tls_id in coresp:
-            traci.trafficlight.setPhase(tls_id, coresp[tls_id])
+        self._set_phases(self._map_info.phase_codes(action_number))
 
         self._simulate(phase_duration)
 
@@ -74,58 +158,53 @@ class Simulation:
         """
         Activate the correct yellow light combination in sumo
         """
-        changed = self._get_changed_actions(old_action_number, action_number)
+        self._set_phases(self._map_info.yellow_codes(old_action_number, action_number))
 
-        for tlsID in traci.trafficlight.getIDList():
-            if tlsID in changed:
-                yellow_phase_code = self.action_to_state(old_action_number)[tlsID] + 1
-                traci.trafficlight.setPhase(tlsID, yellow_phase_code)
-            else:
-                phase_code = self.action_to_state(action_number)[tlsID]
-                traci.trafficlight.setPhase(tlsID, phase_code)
+    def _set_phases(self, phase_codes):
+        """
+        Set the phase of every intersection of the map, given in the order of Map.intersections
+        """
+        for tls_id, phase_code in zip(self._map_info.intersections, phase_codes.tolist()):
+            traci.trafficlight.setPhase(tls_id, phase_code)
 
     def _get_queue_length(self):
         """
         Retrieve the number of cars with speed = 0 in every incoming lane
         """
-        queue_length = 0
-        for id in self._Roads:
-            queue_length += traci.edge.getLastStepHaltingNumber(id)
-
-        return queue_length
+        return self._Collector.queue_length()
 
     def _get_CO2(self):
         """
         Retrieve co2 on the edges
         """
-        co2 = 0
-        for id in self._Roads:
-            co2 += traci.edge.getCO2Emission(id)
-        return co2
+        return self._Collector.CO2()
 
     def _get_fuel(self):
         """
         Retrieve co2 on the edges
         """
-        fuel = 0
-        for id in self._Roads:
-            fuel += traci.edge.getFuelConsumption(id)
-        return fuel
+        return self._Collector.fuel()
 
     def _get_waiting_times(self):
         """
         get list of waiting times of the cars 
         """
-        return list(self._all_cars_waiting_time.values())
+        return list(self._WaitingTimeTracker.all_cars_waiting_time.values())
+
+    @property
+    def map_info(self):
+        return self._map_info
+
+    @property
+    def scheduler(self):
+        return self._Scheduler
+
+    @property
+    def setup_time(self):
+        return self._setup_time
 
     def _get_state(self):
         """
         Retrieve the state of the intersection from sumo, in the form of cell occupancy
         """
-        state = np.zeros(self._num_states)
-
-        for i, group in enumerate(self._lane_groups):
-            for lane_id in group:
-                state[i] += traci.lane.getLastStepHaltingNumber(lane_id)
-
-        return state
+        return self._Collector.state(self._num_states)
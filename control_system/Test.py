@@ -1,7 +1,6 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-import traci
 import numpy as np
 import random
 import timeit
@@ -11,22 +10,25 @@ import os
 from shutil import copyfile
 
 from generate_traffic import Traffic_Generator
-from model import TestModel
+from inference import NumpyModel
+from cache import QValueCache
+from scheduler import DecisionScheduler
 from visualization import Visualization
-from utils import import_test_configuration, set_sumo, set_test_path
+from utils import import_test_configuration, set_backend, set_sumo, set_test_path
 
 
 class Test(Simulation):
     def __init__(self, Model, Map_info, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states,
-                 num_actions):
+                 num_actions, Scheduler=None, branching=False):
 
         super().__init__(Model, Map_info, TrafficGen, sumo_cmd, max_steps, green_duration,
-                         yellow_duration, num_states, num_actions)
+                         yellow_duration, num_states, num_actions, Scheduler=Scheduler, branching=branching)
 
         self._reward_episode = []
         self._queue_length_episode = []
         self._CO2_episode = []
         self._fuel_episode = []
+        self._state_episode = []  # the states the decisions were taken on, to evaluate exported models offline
 
     def run(self, episode):
         """
@@ -36,18 +38,18 @@ class Test(Simulation):
 
         # first, generate the route file for this simulation and set up sumo
         self._TrafficGen.generate_traffic(episode)
-        traci.start(self._sumo_cmd)
+        self._start_sumo()
         print("Simulating...")
 
         # inits
         self._step = 0
-        self._waiting_times = {}
         old_total_wait = 0
         old_action = -1  # dummy init
 
         while self._step < self._max_steps:
             # get current state of the intersection
             current_state = self._get_state()
+            self._state_episode.append(current_state)
 
             # calculate reward of previous action: (change in cumulative waiting time between actions) waiting time =
             # seconds waited by a car since the spawn in the environment, cumulated for every car in incoming lanes
@@ -55,7 +57,8 @@ class Test(Simulation):
             reward = old_total_wait - current_total_wait
 
             # choose the light phase to activate, based on the current state of the intersection
-            action = self._choose_action(current_state)
+            # the previous action is kept without asking the model when the scheduler skips the decision
+            action = self._Scheduler.decide(current_state, self._choose_action)
             self._set_phase_and_simulate(old_action, action)
 
             # saving variables for later & accumulate reward
@@ -64,7 +67,7 @@ class Test(Simulation):
 
             self._reward_episode.append(reward)
 
-        traci.close()
+        self._close_sumo()
         simulation_time = round(timeit.default_timer() - start_time, 1)
 
         return simulation_time
@@ -77,7 +80,7 @@ class Test(Simulation):
             steps_todo = self._max_steps - self._step
 
         while steps_todo > 0:
-            traci.simulationStep()  # simulate 1 step in sumo
+            self._simulation_step()  # simulate 1 step in sumo
             self._step += 1  # update the step counter
             steps_todo -= 1
 
@@ -93,7 +96,9 @@ class Test(Simulation):
         """
         Decide wheter to perform an explorative or exploitative action, according to an epsilon-greedy policy
         """
-        return np.argmax(self._Model.predict_one(state))
+        if hasattr(self._Model, 'choose_action'):  # a policy distilled from the network gives the action directly
+            return self._Model.choose_action(state)
+        return self._greedy_action(self._Model.predict_one(state))
 
     @property
     def queue_length_episode(self):
@@ -114,25 +119,46 @@ class Test(Simulation):
     @property
     def reward_episode(self):
         return self._reward_episode
+
+    @property
+    def state_episode(self):
+        return self._state_episode
     
 
 
 
 if __name__ == "__main__":
     config = import_test_configuration(config_file='settings/testing_settings.ini')
+    set_backend(config['gui'], config['backend'])
     sumo_cmd = set_sumo(config['gui'], config['simulation_folder'], config['sumocfg_file_name'], config['max_steps'])
     model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'])
 
-    Model = TestModel(
-        input_dim=config['num_states'],
-        model_path=model_path
-    )
+    if config['inference'] == 'policy':
+        from distill import load_policy
+        Model = load_policy(model_path)  # built by distill.py
+    elif config['inference'] == 'keras':
+        from model import TestModel
+        Model = TestModel(
+            input_dim=config['num_states'],
+            model_path=model_path
+        )
+    else:
+        # the decisions only need the forward pass of the network, tensorflow is not loaded
+        Model = NumpyModel(
+            input_dim=config['num_states'],
+            model_path=model_path,
+            precision=config['precision']
+        )
+    if config['q_cache_size'] > 0 and config['inference'] != 'policy':
+        Model = QValueCache(Model, config['q_cache_size'])  # the weights are frozen, repeated states skip the network
 
     Traffic_Generator = Traffic_Generator(
         config["flow_file"],
         config["route_file"],
         config["n_cars_generated"],
-        config["simulation_time"]
+        config["simulation_time"],
+        config["compact_routes"],
+        config["direct_injection"]
     )
 
     Visualization = Visualization(
@@ -153,7 +179,9 @@ if __name__ == "__main__":
         config['green_duration'],
         config['yellow_duration'],
         config['num_states'],
-        config['num_actions']
+        config['num_actions'],
+        DecisionScheduler(config['skip_unchanged'], config['activity_threshold']),
+        config['branching']
     )
 
 
@@ -161,10 +189,14 @@ if __name__ == "__main__":
     print('\n----- Test episode')
     simulation_time = Test.run(config['episode_seed'])  # run the simulation
     print('Simulation time:', simulation_time, 's')
+    print('Decisions taken:', Test.scheduler.taken, '- skipped:', Test.scheduler.skipped)
+    if isinstance(Model, QValueCache):
+        print('Q-value cache', Model.counters())
 
     print("----- Testing info saved at:", plot_path)
 
     copyfile(src='settings/testing_settings.ini', dst=os.path.join(plot_path, 'testing_settings.ini'))
+    np.save(os.path.join(plot_path, 'states.npy'), np.array(Test.state_episode))
 
     Visualization.save_data_and_plot(data=Test.reward_episode, filename='reward', xlabel='Action step', ylabel='Reward')
     Visualization.save_data_and_plot(data=Test.queue_length_episode, filename='queue', xlabel='Step',
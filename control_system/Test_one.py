@@ -1,7 +1,6 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-import traci
 import numpy as np
 import random
 import timeit
@@ -11,9 +10,8 @@ import os
 from shutil import copyfile
 
 from generate_traffic import Traffic_Generator
-from model import TestModel
 from visualization import Visualization
-from utils import import_test_configuration, set_sumo, set_test_path
+from utils import import_test_configuration, set_backend, set_sumo, set_test_path
 
 
 class Test_TTL(Simulation):
@@ -35,12 +33,11 @@ class Test_TTL(Simulation):
         start_time = timeit.default_timer()
 
         self._TrafficGen.generate_traffic(episode)
-        traci.start(self._sumo_cmd)
+        self._start_sumo()
         print("Simulating...")
 
         # inits
         self._step = 0
-        self._waiting_times = {}
         old_total_wait = 0
         old_action = -1  # dummy init
 
@@ -49,7 +46,7 @@ class Test_TTL(Simulation):
             self._simulate(self._green_duration)
 
 
-        traci.close()
+        self._close_sumo()
         simulation_time = round(timeit.default_timer() - start_time, 1)
 
         return simulation_time
@@ -62,7 +59,7 @@ class Test_TTL(Simulation):
             steps_todo = self._max_steps - self._step
 
         while steps_todo > 0:
-            traci.simulationStep()  # simulate 1 step in sumo
+            self._simulation_step()  # simulate 1 step in sumo
             self._step += 1  # update the step counter
             steps_todo -= 1
             queue_length = self._get_queue_length()
@@ -97,6 +94,7 @@ class Test_TTL(Simulation):
 
 if __name__ == "__main__":
     config = import_test_configuration(config_file='settings/testing_one_settings.ini')
+    set_backend(config['gui'], config['backend'])
     sumo_cmd = set_sumo(config['gui'], config['simulation_folder'], config['sumocfg_file_name'], config['max_steps'])
     model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'])
 
@@ -104,7 +102,9 @@ if __name__ == "__main__":
         config["flow_file"],
         config["route_file"],
         config["n_cars_generated"],
-        config["simulation_time"]
+        config["simulation_time"],
+        config["compact_routes"],
+        config["direct_injection"]
     )
 
     Visualization = Visualization(
@@ -1,105 +1,264 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-import traci
-import numpy as np
 import random
 import timeit
 from Simulation import Simulation
 
 import os
 import datetime
+import shutil
+import tempfile
 from shutil import copyfile
 
 from generate_traffic import Traffic_Generator
-from memory import Memory
+from memory import Memory, PrioritizedMemory, SharedReplayMemory
 from model import TrainModel
 from Map import Map
+from rollout import RolloutPool
+from learner import Learner
+from vec_env import VecTrain
+from cache import QValueCache
+from scheduler import DecisionScheduler
 
 from visualization import Visualization
-from utils import import_train_configuration, set_sumo, set_train_path
+from utils import import_train_configuration, set_backend, set_sumo, set_train_path, load_session, save_session
 
 
 class Train(Simulation):
     def __init__(self, Model, Map_info, Memory, TrafficGen, sumo_cmd, gamma, max_steps, green_duration, yellow_duration,
-                 num_states, num_actions, training_epochs):
+                 num_states, num_actions, training_epochs, reuse_sumo=False, early_termination=False, label=None,
+                 Scheduler=None, branching=False):
 
-        super().__init__(Model, Map_info, TrafficGen, sumo_cmd, max_steps, green_duration,
-                         yellow_duration, num_states, num_actions)
+        super().__init__(Model, Map_info, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states,
+                         num_actions, reuse_sumo, early_termination, label, Scheduler, branching)
 
         self._Memory = Memory
         self._gamma = gamma
         self._reward_store = []
         self._cumulative_wait_store = []
         self._avg_queue_length_store = []
+        self._decisions_taken_store = []
+        self._decisions_skipped_store = []
         self._training_epochs = training_epochs
 
+        # in actor-learner mode the episodes are simulated with a copy of the model trained in the background
+        self._ActorModel = Model
+        self._Learner = None
+        self._actor_version = 0
+        self._sync_interval = 1
+        self._transitions = 0
+
     def run(self, episode, epsilon):
         """
         Runs an episode of simulation, then starts a training session
         """
+        print("Simulating...")
+        simulation_time = self.simulate(episode, epsilon)
+        print("Total reward:", self._sum_neg_reward, "- Epsilon:", round(epsilon, 2))
+        print("Decisions taken:", self._Scheduler.taken, "- skipped:", self._Scheduler.skipped)
+
+        print("Training...")
+        training_time = self.train()
+
+        return simulation_time, training_time
+
+    def simulate(self, episode, epsilon):
+        """
+        Runs an episode of simulation, storing the samples into the memory
+        """
         start_time = timeit.default_timer()
 
-        # first, generate the route file for this simulation and set up sumo
+        self.begin_episode(episode)
 
-        self._TrafficGen.generate_traffic(episode)
+        while not self.episode_done:
 
-        # self._TrafficGen.generate_traffic(seed=episode)
-        traci.start(self._sumo_cmd)
-        print("Simulating...")
+            current_state = self.observe()
+            if self.episode_done:
+                break
+
+            # pick up the weights refreshed by the learner
+            self._decisions += 1
+            if self._Learner is not None and self._decisions % self._sync_interval == 0:
+                self._sync_actor()
+
+            # choose the light phase to activate, based on the current state of the intersection,
+            # the previous one is kept without asking the model when the scheduler skips the decision
+            action = self._Scheduler.decide(current_state, lambda state: self._choose_action(state, epsilon))
+
+            self.act(action)
+
+        self.end_episode()
+        simulation_time = round(timeit.default_timer() - start_time, 1)
+
+        return simulation_time
+
+    def begin_episode(self, episode):
+        """
+        Generate the route file of the episode, set up sumo and reset the episode variables
+        """
+        self._TrafficGen.generate_traffic(episode)
+        self._start_sumo()
 
         # inits
-        self._waiting_times = {}
         self._step = 0
         self._sum_neg_reward = 0
         self._sum_queue_length = 0
         self._sum_waiting_time = 0
-        old_total_wait = 0
-        old_state = -1
-        old_action = -1
+        self._old_total_wait = 0
+        self._old_state = -1
+        self._old_action = -1
+        self._transitions = 0
+        self._decisions = 0
 
-        while self._step < self._max_steps:
+    def observe(self):
+        """
+        Retrieve the current state, store the sample of the previous action into the memory and return the state
+        """
+        # get current state of the intersection
+        self._current_state = self._get_state()
 
-            # get current state of the intersection
-            current_state = self._get_state()
+        # calculate reward of previous action: (change in cumulative waiting time between actions)
+        # waiting time = seconds waited by a car since the spawn in the environment,
+        # cumulated for every car in incoming lanes
+        self._current_total_wait = self._collect_waiting_times()
+        reward = self._old_total_wait - self._current_total_wait
 
-            # calculate reward of previous action: (change in cumulative waiting time between actions)
-            # waiting time = seconds waited by a car since the spawn in the environment,
-            # cumulated for every car in incoming lanes
-            current_total_wait = self._collect_waiting_times()
-            reward = old_total_wait - current_total_wait
+        # saving the data into the memory
+        if self._step != 0:
+            self._Memory.add_sample((self._old_state, self._old_action, reward, self._current_state))
+            self._transitions += 1
 
-            # saving the data into the memory
-            if self._step != 0:
-                self._Memory.add_sample((old_state, old_action, reward, current_state))
+        # saving only the meaningful reward to better see if the agent is behaving correctly
+        if reward < 0:
+            self._sum_neg_reward += reward
 
-            # choose the light phase to activate, based on the current state of the intersection
-            action = self._choose_action(current_state, epsilon)
+        # the remaining steps add nothing to the queue and waiting time sums, which stay averaged over max_steps
+        if self._tail_is_empty():
+            print("Network empty at step", self._step, "- skipping the rest of the episode")
+            self._step = self._max_steps
 
-            self._set_phase_and_simulate(old_action, action)
+        return self._current_state
 
-            # saving variables for later & accumulate reward
-            old_state = current_state
-            old_action = action
-            old_total_wait = current_total_wait
-            # old_queue = queue
+    def act(self, action):
+        """
+        Activate the chosen light phase and simulate until the next decision
+        """
+        self._set_phase_and_simulate(self._old_action, action)
 
-            # saving only the meaningful reward to better see if the agent is behaving correctly
-            if reward < 0:
-                self._sum_neg_reward += reward
+        # saving variables for later
+        self._old_state = self._current_state
+        self._old_action = action
+        self._old_total_wait = self._current_total_wait
 
+    def end_episode(self):
+        """
+        Save the stats of the episode and release sumo
+        """
         self._save_episode_stats()
-        print("Total reward:", self._sum_neg_reward, "- Epsilon:", round(epsilon, 2))
-        traci.close()
-        simulation_time = round(timeit.default_timer() - start_time, 1)
+        self._close_sumo()
 
-        print("Training...")
+    @property
+    def episode_done(self):
+        return self._step >= self._max_steps
+
+    def train(self):
+        """
+        Runs a training session on the samples of the memory
+        """
         start_time = timeit.default_timer()
         for _ in range(self._training_epochs):
             self._replay()
         training_time = round(timeit.default_timer() - start_time, 1)
 
-        return simulation_time, training_time
+        return training_time
+
+    def start_learner(self, ActorModel, sync_interval):
+        """
+        Train the model continuously in a background thread, the episodes are then simulated with ActorModel,
+        a copy of the model refreshed every sync_interval decisions
+        """
+        self._ActorModel = ActorModel
+        self._ActorModel.set_weights(self._Model.get_weights())
+        self._actor_version = 0
+        self._sync_interval = sync_interval
+        self._Learner = Learner(self._replay, self._Model)
+        self._Learner.start()
+
+    def stop_learner(self):
+        self._Learner.stop()
+        self._Learner = None
+        self._ActorModel = self._Model
+
+    def _sync_actor(self):
+        """
+        Load the last weights published by the learner into the actor model
+        """
+        version, weights = self._Learner.latest_weights()
+        if version != self._actor_version:
+            self._ActorModel.set_weights(weights)
+            self._actor_version = version
+
+    def checkpoint(self, path, episodes_done, finished=False):
+        """
+        Save the model with its optimizer and a snapshot of the memory into a new checkpoint folder of the model path,
+        then the stats of the episodes done so far into the session file, replaced last so that it always points
+        to a complete checkpoint. The older checkpoints are removed once the session points to the new one
+        """
+        checkpoints_path = os.path.join(path, 'checkpoint')
+        os.makedirs(checkpoints_path, exist_ok=True)
+        folder = tempfile.mkdtemp(prefix='episode_' + str(episodes_done) + '_', dir=checkpoints_path)
+
+        if self._Learner is not None:
+            with self._Learner.paused():
+                self._Model.save_checkpoint(os.path.join(folder, 'model'))
+        else:
+            self._Model.save_checkpoint(os.path.join(folder, 'model'))
+        self._Memory.save(os.path.join(folder, 'replay'))
+
+        save_session(path, {
+            'episode': episodes_done,
+            'finished': finished,
+            'checkpoint': os.path.basename(folder),
+            'reward_store': [float(value) for value in self._reward_store],
+            'cumulative_wait_store': [float(value) for value in self._cumulative_wait_store],
+            'avg_queue_length_store': [float(value) for value in self._avg_queue_length_store],
+            'decisions_taken_store': self._decisions_taken_store,
+            'decisions_skipped_store': self._decisions_skipped_store,
+        })
+
+        for name in os.listdir(checkpoints_path):
+            if name != os.path.basename(folder):
+                shutil.rmtree(os.path.join(checkpoints_path, name), ignore_errors=True)
+
+    def resume(self, path):
+        """
+        Load the checkpoint the session file of the model path points to, return the number of episodes it had done
+        """
+        session = load_session(path)
+        if session is None:
+            return 0
+
+        folder = os.path.join(path, 'checkpoint', session['checkpoint'])
+        self._Model.load_checkpoint(os.path.join(folder, 'model'))
+        if not self._Memory.restore(os.path.join(folder, 'replay')):
+            raise ValueError("The checkpoint " + folder + " has no replay memory to resume from")
+        self._reward_store = session['reward_store']
+        self._cumulative_wait_store = session['cumulative_wait_store']
+        self._avg_queue_length_store = session['avg_queue_length_store']
+        self._decisions_taken_store = session.get('decisions_taken_store', [])
+        self._decisions_skipped_store = session.get('decisions_skipped_store', [])
+        return session['episode']
+
+    def add_rollout(self, samples, stats):
+        """
+        Store the samples and the stats of an episode simulated by a rollout worker
+        """
+        for sample in samples:
+            self._Memory.add_sample(sample)
+
+        self._sum_neg_reward, self._sum_waiting_time, self._sum_queue_length, taken, skipped = stats
+        self._save_episode_stats(taken, skipped)
 
     def _simulate(self, steps_todo):
         """
@@ -110,7 +269,7 @@ class Train(Simulation):
             steps_todo = self._max_steps - self._step
 
         while steps_todo > 0:
-            traci.simulationStep()  # simulate 1 step in sumo
+            self._simulation_step()  # simulate 1 step in sumo
             self._step += 1  # update the step counter
             steps_todo -= 1
             queue_length = self._get_queue_length()
@@ -126,44 +285,50 @@ class Train(Simulation):
         if random.random() < epsilon:
             return random.randint(0, self._num_actions - 1)  # random action
         else:
-            return np.argmax(self._Model.predict_one(state))  # the best action given the current state
+            return self._greedy_action(self._ActorModel.predict_one(state))  # the best action given the current state
 
     def _replay(self):
         """
-        Retrieve a group of samples from the memory and for each of them update the learning equation, then train
+        Retrieve a group of samples from the memory and for each of them update the learning equation, then train,
+        return whether the memory was full enough to train
         """
         batch = self._Memory.get_samples(self._Model.batch_size)
 
-        if len(batch) > 0:  # if the memory is full enough
-            states = np.array([val[0] for val in batch])  # extract states from the batch
-            next_states = np.array([val[3] for val in batch])  # extract next states from the batch
-
-            # prediction
-            q_s_a = self._Model.predict_batch(states)  # predict Q(state), for every sample
-            q_s_a_d = self._Model.predict_batch(next_states)  # predict Q(next_state), for every sample
+        if batch is not None:  # if the memory is full enough
+            states, actions, rewards, next_states, indices, weights = batch
 
-            # setup training arrays
-            x = np.zeros((len(batch), self._num_states))
-            y = np.zeros((len(batch), self._num_actions))
+            # predict Q(state) and Q(next_state), update Q(state, action) and train the NN in one compiled step
+            td_errors = self._Model.replay_step(states, actions, rewards, next_states, self._gamma, weights)
+            self._Memory.update_priorities(indices, td_errors)
+            return True
 
-            for i, b in enumerate(batch):
-                state, action, reward, _ = b[0], b[1], b[2], b[3]  # extract data from one sample
-                current_q = q_s_a[i]  # get the Q(state) predicted before
-                current_q[action] = reward + self._gamma * np.amax(q_s_a_d[i])  # update Q(state, action)
-                x[i] = state
-                y[i] = current_q  # Q(state) that includes the updated action value
+        return False
 
-            self._Model.train_batch(x, y)  # train the NN
-
-    def _save_episode_stats(self):
+    def _save_episode_stats(self, taken=None, skipped=None):
         """
-        Save the stats of the episode to plot the graphs at the end of the session
+        Save the stats of the episode to plot the graphs at the end of the session, the decision counts
+        are the ones of the scheduler unless they come from a rollout worker
         """
         self._reward_store.append(self._sum_neg_reward)  # how much negative reward in this episode
         self._cumulative_wait_store.append(
             self._sum_waiting_time)  # total number of seconds waited by cars in this episode
         self._avg_queue_length_store.append(
             self._sum_queue_length / self._max_steps)  # average number of queued cars per step, in this episode
+        self._decisions_taken_store.append(self._Scheduler.taken if taken is None else taken)
+        self._decisions_skipped_store.append(self._Scheduler.skipped if skipped is None else skipped)
+
+    @property
+    def episode_stats(self):
+        return (self._sum_neg_reward, self._sum_waiting_time, self._sum_queue_length, self._Scheduler.taken,
+                self._Scheduler.skipped)
+
+    @property
+    def transitions(self):
+        return self._transitions
+
+    @property
+    def gradient_steps(self):
+        return self._Learner.gradient_steps if self._Learner is not None else 0
 
     @property
     def reward_store(self):
@@ -177,12 +342,23 @@ class Train(Simulation):
     def avg_queue_length_store(self):
         return self._avg_queue_length_store
 
+    @property
+    def decisions_skipped_store(self):
+        return self._decisions_skipped_store
+
 
 if __name__ == "__main__":
 
     config = import_train_configuration(config_file='settings/training_settings.ini')
+    # libsumo runs a single simulation per process, the lockstep environments need traci connections
+    vectorized = config['rollout_workers'] <= 1 and config['num_envs'] > 1
+    set_backend(config['gui'], 'traci' if vectorized else config['backend'])
     sumo_cmd = set_sumo(config['gui'], config['simulation_folder'], config['sumocfg_file_name'], config['max_steps'])
-    path = set_train_path(config['models_path_name'])
+    path = set_train_path(config['models_path_name'], config['resume'])
+
+    Map = Map(
+        config['map']
+    )
 
     Model = TrainModel(
         config['num_layers'],
@@ -190,19 +366,42 @@ if __name__ == "__main__":
         config['batch_size'],
         config['learning_rate'],
         input_dim=config['num_states'],
-        output_dim=config['num_actions']
-    )
-
-    Memory = Memory(
-        config['memory_size_max'],
-        config['memory_size_min']
+        output_dim=config['num_actions'],
+        jit_compile=config['jit_compile'],
+        heads=Map.phases if config['branching'] else None
     )
+    # only the sequential loop predicts one state at a time with this model, the actor-learner loop caches
+    # the predictions of its actor copy instead, the rollout workers and the lockstep environments predict otherwise
+    sequential = config['rollout_workers'] <= 1 and not vectorized and not config['actor_learner']
+    if config['q_cache_size'] > 0 and sequential:
+        Model = QValueCache(Model, config['q_cache_size'])  # repeated states skip the network until the next update
+
+    if config['prioritized']:
+        Memory = PrioritizedMemory(
+            config['memory_size_max'],
+            config['memory_size_min'],
+            config['alpha'],
+            config['beta']
+        )
+    elif config['shared_memory']:
+        Memory = SharedReplayMemory(
+            config['memory_size_max'],
+            config['memory_size_min'],
+            (config['num_states'],)
+        )
+    else:
+        Memory = Memory(
+            config['memory_size_max'],
+            config['memory_size_min']
+        )
 
     Traffic_Generator = Traffic_Generator(
         config["flow_file"],
         config["route_file"],
         config["n_cars_generated"],
-        config["simulation_time"]
+        config["simulation_time"],
+        config["compact_routes"],
+        config["direct_injection"]
     )
 
     Visualization = Visualization(
@@ -210,10 +409,6 @@ if __name__ == "__main__":
         dpi=96
     )
 
-    Map = Map(
-        config['map']
-    )
-
     Train = Train(
         Model,
         Map,
@@ -226,19 +421,115 @@ if __name__ == "__main__":
         config['yellow_duration'],
         config['num_states'],
         config['num_actions'],
-        config['training_epochs']
+        config['training_epochs'],
+        config['reuse_sumo'],
+        config['early_termination'],
+        Scheduler=DecisionScheduler(config['skip_unchanged'], config['activity_threshold']),
+        branching=config['branching']
     )
 
-    episode = 0
+    episode = Train.resume(path)
+    if episode > 0:
+        print("----- Resuming the session saved at", path, "after", episode, "episodes")
     timestamp_start = datetime.datetime.now()
 
-    while episode < config['total_episodes']:
-        print('\n----- Episode', str(episode + 1), 'of', str(config['total_episodes']))
-        epsilon = 1.0 - (episode / config['total_episodes'])
-        simulation_time, training_time = Train.run(episode, epsilon)  # run the simulation
-        print('Simulation time:', simulation_time, 's - Training time:', training_time, 's - Total:',
-              round(simulation_time + training_time, 1), 's')
-        episode += 1
+    if config['rollout_workers'] > 1:
+        # simulate one episode per worker in parallel, then train on each of them as in the sequential loop
+        Rollouts = RolloutPool(config, config['rollout_workers'], Memory if config['shared_memory'] else None)
+
+        while episode < config['total_episodes']:
+            episodes = range(episode, min(episode + Rollouts.n_workers, config['total_episodes']))
+            epsilons = [1.0 - (e / config['total_episodes']) for e in episodes]
+            rollouts = Rollouts.run(episodes, epsilons, Model.get_weights())
+
+            for (rollout_episode, samples, stats, simulation_time), epsilon in zip(rollouts, epsilons):
+                print('\n----- Episode', str(rollout_episode + 1), 'of', str(config['total_episodes']))
+                Train.add_rollout(samples, stats)
+                print("Total reward:", stats[0], "- Epsilon:", round(epsilon, 2))
+                print("Decisions taken:", stats[3], "- skipped:", stats[4])
+                print("Training...")
+                training_time = Train.train()
+                print('Simulation time:', simulation_time, 's - Training time:', training_time, 's')
+
+            episode += len(episodes)
+            Train.checkpoint(path, episode)
+
+        Rollouts.close()
+
+    elif config['num_envs'] > 1:
+        # step several sumo instances in lockstep, choosing their actions with one batched prediction
+        Envs = VecTrain(config, Model, Memory, config['num_envs'])
+
+        while episode < config['total_episodes']:
+            episodes = range(episode, min(episode + Envs.num_envs, config['total_episodes']))
+            epsilons = [1.0 - (e / config['total_episodes']) for e in episodes]
+            episodes_stats, simulation_time = Envs.run(episodes, epsilons)
+
+            for env_episode, stats, epsilon in zip(episodes, episodes_stats, epsilons):
+                print('\n----- Episode', str(env_episode + 1), 'of', str(config['total_episodes']))
+                Train.add_rollout([], stats)  # the samples are already in the memory
+                print("Total reward:", stats[0], "- Epsilon:", round(epsilon, 2))
+                print("Decisions taken:", stats[3], "- skipped:", stats[4])
+                print("Training...")
+                training_time = Train.train()
+                print('Simulation time:', simulation_time, 's - Training time:', training_time, 's')
+
+            episode += len(episodes)
+            Train.checkpoint(path, episode)
+
+        Envs.close()
+
+    elif config['actor_learner']:
+        # the model is trained in the background while the episodes are simulated with a copy of it
+        ActorModel = TrainModel(
+            config['num_layers'],
+            config['width_layers'],
+            config['batch_size'],
+            config['learning_rate'],
+            input_dim=config['num_states'],
+            output_dim=config['num_actions'],
+            heads=Map.phases if config['branching'] else None
+        )
+        if config['q_cache_size'] > 0:
+            ActorModel = QValueCache(ActorModel, config['q_cache_size'])  # emptied at every sync
+        Train.start_learner(ActorModel, config['sync_interval'])
+
+        while episode < config['total_episodes']:
+            print('\n----- Episode', str(episode + 1), 'of', str(config['total_episodes']))
+            epsilon = 1.0 - (episode / config['total_episodes'])
+            gradient_steps = Train.gradient_steps
+            start_time = timeit.default_timer()
+            Train.simulate(episode, epsilon)
+            elapsed = timeit.default_timer() - start_time
+            gradient_steps = Train.gradient_steps - gradient_steps
+            print("Total reward:", Train.reward_store[-1], "- Epsilon:", round(epsilon, 2))
+            print("Decisions taken:", Train.scheduler.taken, "- skipped:", Train.scheduler.skipped)
+            print('Transitions collected:', Train.transitions, '(', round(Train.transitions / elapsed, 1),
+                  '/s) - Gradient steps:', gradient_steps, '(', round(gradient_steps / elapsed, 1), '/s)')
+            episode += 1
+            Train.checkpoint(path, episode)
+
+        Train.stop_learner()
+        if config['q_cache_size'] > 0:
+            print("----- Actor Q-value cache", ActorModel.counters())
+
+    else:
+        while episode < config['total_episodes']:
+            print('\n----- Episode', str(episode + 1), 'of', str(config['total_episodes']))
+            epsilon = 1.0 - (episode / config['total_episodes'])
+            simulation_time, training_time = Train.run(episode, epsilon)  # run the simulation
+            print('Simulation time:', simulation_time, 's (setup:', Train.setup_time, 's) - Training time:',
+                  training_time, 's - Total:', round(simulation_time + training_time, 1), 's')
+            episode += 1
+            Train.checkpoint(path, episode)
+
+    Train.checkpoint(path, episode, finished=True)
+    Train.close()
+    if config['shared_memory']:
+        Memory.release()
+
+    if config['q_cache_size'] > 0 and sequential:
+        print("\n----- Q-value cache", Model.counters())
 
     print("\n----- Start time:", timestamp_start)
     print("----- End time:", datetime.datetime.now())
@@ -254,3 +545,5 @@ if __name__ == "__main__":
                                      ylabel='Cumulative delay (s)')
     Visualization.save_data_and_plot(data=Train.avg_queue_length_store, filename='queue', xlabel='Episode',
                                      ylabel='Average queue length (vehicles)')
+    Visualization.save_data_and_plot(data=Train.decisions_skipped_store, filename='skipped_decisions',
+                                     xlabel='Episode', ylabel='Decisions skipped by the scheduler')
@@ -0,0 +1,644 @@
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import timeit
+
+from sumo_backend import traci
+import numpy as np
+
+from collector import Collector, WaitingTimeTracker
+from generate_traffic import Traffic_Generator
+from Map import Map
+from memory import Memory, PrioritizedMemory
+from utils import set_backend, set_path, set_sumo
+
+SIMULATION_FOLDER = "intersection"
+
+
+def scenario_files(simulation_name):
+    """
+    Return the sumocfg file name and the flow, route and map files of a bundled scenario
+    """
+    path = SIMULATION_FOLDER + "/" + simulation_name
+    return (path, simulation_name + '.sumocfg', set_path(path, simulation_name, '_flow.json'),
+            set_path(path, simulation_name, '.rou.xml'), set_path(path, simulation_name, "_map.json"))
+
+
+def _polling_waiting_times(roads, waiting_times):
+    """
+    Reference implementation that queries every car of the network
+    """
+    for car_id in traci.vehicle.getIDList():
+        wait_time = traci.vehicle.getAccumulatedWaitingTime(car_id)
+        if traci.vehicle.getRoadID(car_id) in roads:
+            waiting_times[car_id] = wait_time
+        elif car_id in waiting_times:
+            del waiting_times[car_id]
+    return sum(waiting_times.values())
+
+
+def waiting_times(simulation_name, cars, simulation_time, max_steps, green_duration, seed, backend):
+    """
+    Compare the cost per decision of the waiting time tracker with the polling of every car in the network
+    """
+    folder, sumocfg_file_name, flow_file, route_file, map_file = scenario_files(simulation_name)
+    set_backend(False, backend)
+    sumo_cmd = set_sumo(False, folder, sumocfg_file_name, max_steps)
+    Map_info = Map(map_file)
+
+    print("cars\tdecisions\tpolling (ms)\ttracker (ms)")
+    for n_cars in cars:
+        Traffic_Generator(flow_file, route_file, n_cars, simulation_time).generate_traffic(seed)
+        traci.start(sumo_cmd)
+        collector = Collector(Map_info)
+        collector.subscribe()
+        tracker = WaitingTimeTracker(collector)
+        reference = {}
+        polling_time = tracker_time = 0
+        decisions = 0
+
+        for step in range(max_steps):
+            traci.simulationStep()
+            collector.update()
+            if step % green_duration:
+                continue
+
+            start_time = timeit.default_timer()
+            expected = _polling_waiting_times(Map_info.roads, reference)
+            polling_time += timeit.default_timer() - start_time
+
+            start_time = timeit.default_timer()
+            total = tracker.collect()
+            tracker_time += timeit.default_timer() - start_time
+
+            assert total == expected, "tracker diverged at step %d: %s != %s" % (step, total, expected)
+            decisions += 1
+
+        traci.close()
+        print("%d\t%d\t%.3f\t%.3f" % (n_cars, decisions, 1000 * polling_time / decisions,
+                                      1000 * tracker_time / decisions))
+
+
+def steps_per_second(simulation_names, backends, n_cars, simulation_time, max_steps, green_duration, seed):
+    """
+    Measure the simulation throughput of every backend, collecting the metrics like Train and Test do
+    """
+    print("simulation\tbackend\tsteps/s")
+    for simulation_name in simulation_names:
+        folder, sumocfg_file_name, flow_file, route_file, map_file = scenario_files(simulation_name)
+        Map_info = Map(map_file)
+        Traffic_Generator(flow_file, route_file, n_cars, simulation_time).generate_traffic(seed)
+
+        for backend in backends:
+            set_backend(False, backend)
+            sumo_cmd = set_sumo(False, folder, sumocfg_file_name, max_steps)
+            traci.start(sumo_cmd)
+            collector = Collector(Map_info)
+            collector.subscribe()
+            tracker = WaitingTimeTracker(collector)
+
+            start_time = timeit.default_timer()
+            for step in range(max_steps):
+                if step % green_duration == 0:
+                    collector.state(len(Map_info.lane_groups))
+                    tracker.collect()
+                traci.simulationStep()
+                collector.update()
+                collector.queue_length()
+            elapsed = timeit.default_timer() - start_time
+
+            traci.close()
+            print("%s\t%s\t%.0f" % (simulation_name, backend, max_steps / elapsed))
+
+
+def _scalar_cars(TrafficGen):
+    """
+    Reference draw of the cars: one second, one car and one turn at a time, walking the probability lists
+    """
+    conn = TrafficGen.connections
+    cars = []
+    for second, n_cars in enumerate(TrafficGen.rng.poisson(TrafficGen.arrival_rate, TrafficGen.SIMULATION_TIME)):
+        for depart in sorted(np.around(second + TrafficGen.rng.random(n_cars))):
+            pb = TrafficGen.rng.random()
+            edge = next((edge for edge in conn["start"] if pb <= float(conn["start"][edge])),
+                        list(conn["start"])[-1])
+            path = [edge]
+            while conn.get(edge):
+                pb = TrafficGen.rng.random()
+                nexts = conn[edge]
+                edge = next((turn["edge"] for turn in nexts if pb < turn["probability"]), nexts[-1]["edge"])
+                path.append(edge)
+            cars.append((depart, path, TrafficGen.rng.random() < TrafficGen.EMERGENCY_PROBABILITY))
+    return cars
+
+
+def traffic_generation(simulation_names, cars, simulation_time, repeats, seed):
+    """
+    Compare the time to draw the cars of an episode one at a time with the bulk draw of the generator,
+    and report the time of the whole generate_traffic, which also writes the route file
+    """
+    print("simulation\tcars\tscalar draw (ms)\tbulk draw (ms)\tgenerate_traffic (ms)")
+    for simulation_name in simulation_names:
+        folder, sumocfg_file_name, flow_file, route_file, map_file = scenario_files(simulation_name)
+        TrafficGen = Traffic_Generator(flow_file, route_file, 0, simulation_time)
+
+        for n_cars in cars:
+            TrafficGen.arrival_rate = n_cars / simulation_time
+            times = {}
+            for name, draw in [('scalar', lambda: _scalar_cars(TrafficGen)), ('bulk', TrafficGen.generate_cars),
+                               ('generate_traffic', lambda: TrafficGen.generate_traffic(seed))]:
+                TrafficGen.rng = np.random.default_rng(seed)
+                times[name] = min(timeit.repeat(draw, number=1, repeat=repeats))
+
+            print("%s\t%d\t%.1f\t%.1f\t%.1f" % (simulation_name, n_cars, 1000 * times['scalar'], 1000 * times['bulk'],
+                                                 1000 * times['generate_traffic']))
+
+
+def _minidom_route_file(TrafficGen, departs, paths, path_ids, is_emergency):
+    """
+    Reference writer: the whole document built with minidom, serialized with toprettyxml in a single string
+    """
+    from xml.dom.minidom import Document
+
+    doc = Document()
+    root = doc.createElement("routes")
+    root.setAttribute("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
+    root.setAttribute("xsi:noNamespaceSchemaLocation", "http://sumo.dlr.de/xsd/routes_file.xsd")
+    doc.appendChild(root)
+    for attributes in [{"id": "veh_passenger", "vClass": "passenger"},
+                       {"id": "veh_emergency", "vClass": "passenger", "color": "red", "width": "2.5"}]:
+        vType = doc.createElement("vType")
+        for name, value in attributes.items():
+            vType.setAttribute(name, value)
+        root.appendChild(vType)
+
+    for n in range(len(departs)):
+        vehicle = doc.createElement("vehicle")
+        vehicle.setAttribute("id", "veh" + str(n))
+        vehicle.setAttribute("type", "veh_emergency" if is_emergency[n] else "veh_passenger")
+        vehicle.setAttribute("depart", str(float(departs[n])))
+        vehicle.setAttribute("departLane", "best")
+        vehicle.setAttribute("departSpeed", "max")
+        route = doc.createElement("route")
+        route.setAttribute("edges", " ".join(paths[path_ids[n]]))
+        vehicle.appendChild(route)
+        root.appendChild(vehicle)
+
+    with open(TrafficGen.OUT_FILE, 'w') as file:
+        file.write(doc.toprettyxml())
+
+
+def _streamed_route_file(TrafficGen, departs, paths, path_ids, is_emergency):
+    with open(TrafficGen.OUT_FILE, 'w', buffering=1 << 20) as file:
+        TrafficGen.write_header(file)
+        TrafficGen.add_cars(file, departs, paths, path_ids, is_emergency)
+        file.write('</routes>\n')
+
+
+def route_file_writers(simulation_names, cars, simulation_time, seed):
+    """
+    Compare the time and the peak memory of writing the route file of an episode with minidom and with
+    the streaming writer of the generator, checking that both files are the same
+    """
+    import filecmp
+    import tracemalloc
+
+    print("simulation\tcars\twriter\ttime (ms)\tpeak memory (MB)\tfile (MB)")
+    for simulation_name in simulation_names:
+        folder, sumocfg_file_name, flow_file, route_file, map_file = scenario_files(simulation_name)
+
+        for n_cars in cars:
+            TrafficGen = Traffic_Generator(flow_file, route_file, n_cars, simulation_time)
+            TrafficGen.rng = np.random.default_rng(seed)
+            episode_cars = TrafficGen.generate_cars()
+
+            files = []
+            for name, writer in [('minidom', _minidom_route_file), ('streaming', _streamed_route_file)]:
+                TrafficGen.OUT_FILE = route_file.replace('.rou.xml', '_' + name + '.rou.xml')
+                files.append(TrafficGen.OUT_FILE)
+
+                start_time = timeit.default_timer()
+                writer(TrafficGen, *episode_cars)
+                elapsed = timeit.default_timer() - start_time
+
+                tracemalloc.start()
+                writer(TrafficGen, *episode_cars)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                print("%s\t%d\t%s\t%.0f\t%.1f\t%.1f" % (simulation_name, n_cars, name, 1000 * elapsed, peak / 2 ** 20,
+                                                      os.path.getsize(TrafficGen.OUT_FILE) / 2 ** 20))
+
+            print("same file:", filecmp.cmp(*files, shallow=False))
+            for file in files:
+                os.remove(file)
+
+
+def _sumo_load_time(folder, simulation_name, route_file, repeats):
+    """
+    Time for sumo to load the network and every vehicle of the route file at once, the best of the repeats
+    """
+    from sumolib import checkBinary
+
+    cmd = [checkBinary('sumo'), "-n", set_path(folder, simulation_name, '.net.xml'), "-r", route_file,
+           "--route-steps", "0", "--end", "0", "--no-step-log", "--no-warnings"]
+
+    times = []
+    for _ in range(repeats):
+        start_time = timeit.default_timer()
+        subprocess.run(cmd, check=True, capture_output=True)
+        times.append(timeit.default_timer() - start_time)
+    return min(times)
+
+
+def compact_routes(simulation_names, cars, simulation_time, repeats, seed):
+    """
+    Compare the size and the sumo load time of the route file with a route per vehicle and with compact routes,
+    the load time of the network alone being subtracted
+    """
+    print("simulation\tcars\troutes\tfile (KB)\tload (ms)")
+    for simulation_name in simulation_names:
+        folder, sumocfg_file_name, flow_file, route_file, map_file = scenario_files(simulation_name)
+
+        empty_file = route_file.replace('.rou.xml', '_empty.rou.xml')
+        Traffic_Generator(flow_file, empty_file, 0, simulation_time).generate_traffic(seed)
+        network_time = _sumo_load_time(folder, simulation_name, empty_file, repeats)
+        os.remove(empty_file)
+
+        for n_cars in cars:
+            for name, compact in [('per vehicle', False), ('compact', True)]:
+                out_file = route_file.replace('.rou.xml', '_compact.rou.xml' if compact else '_full.rou.xml')
+                Traffic_Generator(flow_file, out_file, n_cars, simulation_time, compact).generate_traffic(seed)
+
+                load_time = _sumo_load_time(folder, simulation_name, out_file, repeats) - network_time
+                print("%s\t%d\t%s\t%.0f\t%.0f" % (simulation_name, n_cars, name, os.path.getsize(out_file) / 1024,
+                                                 1000 * load_time))
+                os.remove(out_file)
+
+
+def injection(simulation_name, n_cars, simulation_time, max_steps, episodes, backend):
+    """
+    Compare the episodes simulated from a route file, reloaded into the running sumo every episode, with the cars
+    injected through traci: time to set up an episode, time of a whole episode, and the cars departed at every step,
+    which have to be the same
+    """
+    folder, sumocfg_file_name, flow_file, route_file, map_file = scenario_files(simulation_name)
+    set_backend(False, backend)
+    sumo_cmd = set_sumo(False, folder, sumocfg_file_name, max_steps)
+
+    departures = {}
+    print("mode\tsetup (ms)\tepisode (s)")
+    for name, compact, inject in [('route file', False, False), ('compact routes', True, False),
+                                  ('injection', False, True)]:
+        TrafficGen = Traffic_Generator(flow_file, route_file, n_cars, simulation_time, compact, inject)
+        traci.start(sumo_cmd)
+        setup_time = episode_time = 0
+        departures[name] = []
+
+        for episode in range(episodes):
+            start_time = timeit.default_timer()
+            TrafficGen.generate_traffic(episode)
+            traci.load(sumo_cmd[1:])
+            TrafficGen.register_routes()
+            setup_time += timeit.default_timer() - start_time
+
+            for step in range(max_steps):
+                TrafficGen.inject(step)
+                traci.simulationStep()
+                departures[name].append(traci.simulation.getDepartedNumber())
+            episode_time += timeit.default_timer() - start_time
+
+        traci.close()
+        print("%s\t%.1f\t%.2f" % (name, 1000 * setup_time / episodes, episode_time / episodes))
+
+    print("same departures:", all(departures[name] == departures['route file'] for name in departures))
+
+
+def _shared_memory_writer(Memory, worker_id, n_samples, num_states):
+    """
+    Rollout worker stand-in: add samples whose every column is derived from a counter, so a torn row shows
+    """
+    for i in range(n_samples):
+        k = (worker_id * n_samples + i) % 60000
+        state = np.full(num_states, k)
+        Memory.add_sample((state, k % 9, -k, state))
+    Memory.release()
+
+
+def _torn_rows(states, actions, rewards, next_states):
+    """
+    Number of rows of a batch that mix the columns of different samples
+    """
+    k = states[:, 0]
+    consistent = ((states == k[:, None]).all(axis=1) & (next_states == states).all(axis=1) & (actions == k % 9) &
+                  (rewards == -k))
+    return int((~consistent).sum())
+
+
+def shared_memory_sampling(size, batch_size, num_states, workers, samples_per_worker):
+    """
+    Sample the shared memory while worker processes write into it, checking every row of every batch,
+    against a plain gather of the same slots without the sequence check
+    """
+    from memory import SharedReplayMemory
+
+    Memory = SharedReplayMemory(size, batch_size, (num_states,))
+    context = multiprocessing.get_context('spawn')
+    writers = [context.Process(target=_shared_memory_writer, args=(Memory, i, samples_per_worker, num_states))
+               for i in range(workers)]
+    for writer in writers:
+        writer.start()
+
+    batches = empty = torn = torn_unchecked = 0
+    start_time = timeit.default_timer()
+    while any(writer.is_alive() for writer in writers):
+        batch = Memory.get_samples(batch_size)
+        if batch is None:
+            empty += Memory._committed.value >= batch_size  # not counted while the memory fills up
+            continue
+        batches += 1
+        torn += _torn_rows(*batch[:4])
+        torn_unchecked += _torn_rows(*Memory._batch(batch[4]))
+    elapsed = timeit.default_timer() - start_time
+
+    for writer in writers:
+        writer.join()
+    print("samples written: %d - committed: %d" % (Memory._reserved.value, Memory._committed.value))
+    print("batches: %d (%.0f/s) - none: %d" % (batches, batches / elapsed, empty))
+    print("torn rows: %d with the sequence check - %d regathering the same slots without it" % (torn, torn_unchecked))
+    Memory.release()
+
+
+def replay_sampling(sizes, batch_size, num_states, batches, alpha, beta, seed):
+    """
+    Measure the sampling throughput of the uniform and prioritized memories once they are full
+    """
+    rng = np.random.default_rng(seed)
+
+    print("size\tmemory\tbatches/s\tsamples/s")
+    for size in sizes:
+        memories = [('uniform', Memory(size, batch_size)),
+                    ('prioritized', PrioritizedMemory(size, batch_size, alpha, beta))]
+        states = rng.integers(0, 40, (size, num_states))
+        actions = rng.integers(0, 9, size)
+        rewards = -rng.random(size) * 100
+
+        for name, memory in memories:
+            for i in range(size):
+                memory.add_sample((states[i], actions[i], rewards[i], states[i - 1]))
+
+            start_time = timeit.default_timer()
+            for _ in range(batches):
+                batch = memory.get_samples(batch_size)
+                memory.update_priorities(batch[4], rng.standard_normal(batch_size) * 100)  # td errors
+            elapsed = timeit.default_timer() - start_time
+
+            print("%d\t%s\t%.0f\t%.0f" % (size, name, batches / elapsed, batches * batch_size / elapsed))
+
+
+def _predict_fit_replay(Model, batch, gamma):
+    """
+    Reference replay step: two forward passes, the targets written into the predictions, then a keras fit
+    """
+    states, actions, rewards, next_states, indices, weights = batch
+    rows = np.arange(len(actions))
+
+    q_s_a = Model.predict_batch(states)
+    q_s_a_d = Model.predict_batch(next_states)
+
+    targets = rewards + gamma * np.amax(q_s_a_d, axis=1)
+    td_errors = targets - q_s_a[rows, actions]
+    q_s_a[rows, actions] = targets
+
+    Model.train_batch(states, q_s_a, weights)
+    return td_errors
+
+
+def gradient_steps(batch_sizes, num_states, num_actions, num_layers, width, steps, gamma, jit_compile, seed):
+    """
+    Measure the replay steps per second of the predict and fit reference against the fused compiled step
+    """
+    # imported here so that the other benchmarks do not load tensorflow
+    from model import TrainModel
+
+    rng = np.random.default_rng(seed)
+    Model = TrainModel(num_layers, width, max(batch_sizes), 0.001, num_states, num_actions, jit_compile=jit_compile)
+    replay_steps = [('predict+fit', lambda batch: _predict_fit_replay(Model, batch, gamma)),
+                    ('fused', lambda batch: Model.replay_step(*batch[:4], gamma, batch[5]))]
+
+    print("batch\treplay\tsteps/s")
+    for batch_size in batch_sizes:
+        memory = Memory(batch_size * 10, batch_size)
+        for _ in range(batch_size * 10):
+            memory.add_sample((rng.integers(0, 40, num_states), rng.integers(0, num_actions), -rng.random() * 100,
+                               rng.integers(0, 40, num_states)))
+
+        for name, replay_step in replay_steps:
+            replay_step(memory.get_samples(batch_size))  # warm up, tracing the graphs
+
+            start_time = timeit.default_timer()
+            for _ in range(steps):
+                replay_step(memory.get_samples(batch_size))
+            elapsed = timeit.default_timer() - start_time
+
+            print("%d\t%s\t%.1f" % (batch_size, name, steps / elapsed))
+
+
+def inference(model_path, num_states, decisions, seed):
+    """
+    Compare the numpy forward pass with the keras model it was exported from: agreement and decisions per second
+    """
+    from inference import NumpyModel
+    from model import TestModel
+
+    rng = np.random.default_rng(seed)
+    states = rng.integers(0, 40, (decisions, num_states))
+    models = [('keras', TestModel(num_states, model_path)), ('numpy', NumpyModel(num_states, model_path))]
+
+    q_values = {}
+    print("model\tdecisions/s")
+    for name, model in models:
+        start_time = timeit.default_timer()
+        q_values[name] = np.concatenate([model.predict_one(state) for state in states])
+        print("%s\t%.0f" % (name, decisions / (timeit.default_timer() - start_time)))
+
+    print("max abs difference: %.2e" % np.abs(q_values['keras'] - q_values['numpy']).max())
+    print("same actions: %.2f%%" % (100 * np.mean(q_values['keras'].argmax(1) == q_values['numpy'].argmax(1))))
+
+
+def quantization(model_path, states_file, repeats):
+    """
+    Report the file size, memory, speed and agreement of the float16 and int8 exports with the float32 weights
+    on the states recorded by a test run
+    """
+    from inference import PRECISIONS, NumpyModel, weights_file
+
+    states = np.load(states_file)
+    models = {precision: NumpyModel(states.shape[1], model_path, precision) for precision in PRECISIONS}
+    reference = models['float32'].predict_batch(states)
+
+    print("%d recorded states" % len(states))
+    print("precision\tsize (KB)\tmemory (KB)\tdecisions/s\tmax abs difference\tdifferent actions")
+    for precision, model in models.items():
+        start_time = timeit.default_timer()
+        for _ in range(repeats):
+            for state in states:
+                model.predict_one(state)
+        decisions_per_second = repeats * len(states) / (timeit.default_timer() - start_time)
+
+        q_values = model.predict_batch(states)
+        different = np.mean(q_values.argmax(1) != reference.argmax(1))
+        print("%s\t%.0f\t%.0f\t%.0f\t%.2e\t%.2f%%" % (precision,
+                                                   os.path.getsize(weights_file(model_path, precision)) / 1024,
+                                                   model.nbytes / 1024, decisions_per_second,
+                                                   np.abs(q_values - reference).max(), 100 * different))
+
+
+IMPORT_PROBE = """
+import sys, timeit
+start_time = timeit.default_timer()
+import %s
+print(timeit.default_timer() - start_time, 'tensorflow' in sys.modules, 'matplotlib' in sys.modules)
+"""
+
+
+def import_times(entry_points, repeats):
+    """
+    Measure the import time of each entry point in a fresh interpreter, and which heavy libraries it loads
+    """
+    print("entry point\timport (s)\ttensorflow\tmatplotlib")
+    for entry_point in entry_points:
+        runs = []
+        for _ in range(repeats):
+            output = subprocess.run([sys.executable, "-c", IMPORT_PROBE % entry_point], capture_output=True, text=True,
+                                    check=True).stdout.split()[-3:]
+            runs.append(output)
+
+        elapsed = min(float(run[0]) for run in runs)
+        print("%s\t%.2f\t%s\t%s" % (entry_point, elapsed, runs[0][1], runs[0][2]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Performance benchmarks of the control system")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_wait = subparsers.add_parser("waiting_times", help="cost per decision of the waiting time collection")
+    parser_wait.add_argument("--simulation", default="ain_naadja")
+    parser_wait.add_argument("--cars", type=int, nargs="+", default=[500, 1000, 2000, 4000])
+    parser_wait.add_argument("--simulation-time", type=int, default=1000)
+    parser_wait.add_argument("--max-steps", type=int, default=2000)
+    parser_wait.add_argument("--green-duration", type=int, default=10)
+    parser_wait.add_argument("--seed", type=int, default=0)
+    parser_wait.add_argument("--backend", default="traci")
+
+    parser_steps = subparsers.add_parser("steps", help="simulation steps per second of the sumo backends")
+    parser_steps.add_argument("--simulations", nargs="+", default=["two", "three", "ain_naadja"])
+    parser_steps.add_argument("--backends", nargs="+", default=["traci", "libsumo"])
+    parser_steps.add_argument("--cars", type=int, default=1500)
+    parser_steps.add_argument("--simulation-time", type=int, default=1000)
+    parser_steps.add_argument("--max-steps", type=int, default=4000)
+    parser_steps.add_argument("--green-duration", type=int, default=10)
+    parser_steps.add_argument("--seed", type=int, default=0)
+
+    parser_traffic = subparsers.add_parser("traffic", help="time to draw and write the cars of an episode")
+    parser_traffic.add_argument("--simulations", nargs="+", default=["two", "three", "ain_naadja"])
+    parser_traffic.add_argument("--cars", type=int, nargs="+", default=[1500, 15000])
+    parser_traffic.add_argument("--simulation-time", type=int, default=1000)
+    parser_traffic.add_argument("--repeats", type=int, default=3)
+    parser_traffic.add_argument("--seed", type=int, default=0)
+
+    parser_writer = subparsers.add_parser("route_file", help="time and memory to write the route file")
+    parser_writer.add_argument("--simulations", nargs="+", default=["two", "three", "ain_naadja"])
+    parser_writer.add_argument("--cars", type=int, nargs="+", default=[1500, 15000])
+    parser_writer.add_argument("--simulation-time", type=int, default=1000)
+    parser_writer.add_argument("--seed", type=int, default=0)
+
+    parser_compact = subparsers.add_parser("compact_routes", help="size and load time of the compact route file")
+    parser_compact.add_argument("--simulations", nargs="+", default=["two", "three", "ain_naadja"])
+    parser_compact.add_argument("--cars", type=int, nargs="+", default=[1500, 15000])
+    parser_compact.add_argument("--simulation-time", type=int, default=1000)
+    parser_compact.add_argument("--repeats", type=int, default=5)
+    parser_compact.add_argument("--seed", type=int, default=0)
+
+    parser_injection = subparsers.add_parser("injection", help="route file episodes against traci injection")
+    parser_injection.add_argument("--simulation", default="ain_naadja")
+    parser_injection.add_argument("--cars", type=int, default=1500)
+    parser_injection.add_argument("--simulation-time", type=int, default=1000)
+    parser_injection.add_argument("--max-steps", type=int, default=4000)
+    parser_injection.add_argument("--episodes", type=int, default=5)
+    parser_injection.add_argument("--backend", default="libsumo")
+
+    parser_replay = subparsers.add_parser("replay", help="sampling throughput of the replay memories")
+    parser_replay.add_argument("--sizes", type=int, nargs="+", default=[50000, 200000, 1000000])
+    parser_replay.add_argument("--batch-size", type=int, default=100)
+    parser_replay.add_argument("--num-states", type=int, default=11)
+    parser_replay.add_argument("--batches", type=int, default=2000)
+    parser_replay.add_argument("--alpha", type=float, default=0.6)
+    parser_replay.add_argument("--beta", type=float, default=0.4)
+    parser_replay.add_argument("--seed", type=int, default=0)
+
+    parser_shared = subparsers.add_parser("shared_memory", help="sampling the shared memory while workers write")
+    parser_shared.add_argument("--size", type=int, default=2000)
+    parser_shared.add_argument("--batch-size", type=int, default=100)
+    parser_shared.add_argument("--num-states", type=int, default=11)
+    parser_shared.add_argument("--workers", type=int, default=2)
+    parser_shared.add_argument("--samples-per-worker", type=int, default=200000)
+
+    parser_gradient = subparsers.add_parser("gradient_steps", help="replay steps per second of the training")
+    parser_gradient.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 100, 400])
+    parser_gradient.add_argument("--num-states", type=int, default=11)
+    parser_gradient.add_argument("--num-actions", type=int, default=9)
+    parser_gradient.add_argument("--num-layers", type=int, default=5)
+    parser_gradient.add_argument("--width", type=int, default=400)
+    parser_gradient.add_argument("--steps", type=int, default=200)
+    parser_gradient.add_argument("--gamma", type=float, default=0.75)
+    parser_gradient.add_argument("--jit-compile", action="store_true")
+    parser_gradient.add_argument("--seed", type=int, default=0)
+
+    parser_inference = subparsers.add_parser("inference", help="numpy inference against the keras model")
+    parser_inference.add_argument("--model-path", default="models/model_9")
+    parser_inference.add_argument("--num-states", type=int, default=17)
+    parser_inference.add_argument("--decisions", type=int, default=500)
+    parser_inference.add_argument("--seed", type=int, default=0)
+
+    parser_quantization = subparsers.add_parser("quantization", help="float16 and int8 exports against float32")
+    parser_quantization.add_argument("--model-path", default="models/model_9")
+    parser_quantization.add_argument("--states", default="models/model_9/test/states.npy")
+    parser_quantization.add_argument("--repeats", type=int, default=1)
+
+    parser_imports = subparsers.add_parser("imports", help="import time of the entry points")
+    parser_imports.add_argument("--entry-points", nargs="+",
+                                default=["Train", "Test", "Test_one", "Test_ttl", "distill", "benchmark"])
+    parser_imports.add_argument("--repeats", type=int, default=3)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "waiting_times":
+        waiting_times(args.simulation, args.cars, args.simulation_time, args.max_steps, args.green_duration,
+                      args.seed, args.backend)
+    elif args.benchmark == "steps":
+        steps_per_second(args.simulations, args.backends, args.cars, args.simulation_time, args.max_steps,
+                         args.green_duration, args.seed)
+    elif args.benchmark == "traffic":
+        traffic_generation(args.simulations, args.cars, args.simulation_time, args.repeats, args.seed)
+    elif args.benchmark == "route_file":
+        route_file_writers(args.simulations, args.cars, args.simulation_time, args.seed)
+    elif args.benchmark == "compact_routes":
+        compact_routes(args.simulations, args.cars, args.simulation_time, args.repeats, args.seed)
+    elif args.benchmark == "injection":
+        injection(args.simulation, args.cars, args.simulation_time, args.max_steps, args.episodes, args.backend)
+    elif args.benchmark == "replay":
+        replay_sampling(args.sizes, args.batch_size, args.num_states, args.batches, args.alpha, args.beta, args.seed)
+    elif args.benchmark == "shared_memory":
+        shared_memory_sampling(args.size, args.batch_size, args.num_states, args.workers, args.samples_per_worker)
+    elif args.benchmark == "gradient_steps":
+        gradient_steps(args.batch_sizes, args.num_states, args.num_actions, args.num_layers, args.width, args.steps,
+                       args.gamma, args.jit_compile, args.seed)
+    elif args.benchmark == "inference":
+        inference(args.model_path, args.num_states, args.decisions, args.seed)
+    elif args.benchmark == "quantization":
+        quantization(args.model_path, args.states, args.repeats)
+    elif args.benchmark == "imports":
+        import_times(args.entry_points, args.repeats)
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class QValueCache:
+    """
+    Bounded LRU cache in front of the predict_one of a model, keyed on the integer state. The states are halting
+    counts per lane group, so they recur often and a repeated state skips the network. The cache is emptied
+    whenever the weights_version of the model changes, models without one are considered frozen
+    """
+    def __init__(self, Model, size_max):
+        self._Model = Model
+        self._size_max = size_max
+        self._q_values = OrderedDict()
+        self._weights_version = self._model_version()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def _model_version(self):
+        return getattr(self._Model, 'weights_version', 0)
+
+
+    def predict_one(self, state):
+        """
+        Predict the action values from a single state, from the cache when the state was already seen
+        with the current weights
+        """
+        if self._model_version() != self._weights_version:
+            self.invalidate()
+
+        key = np.asarray(state, dtype=np.int64).tobytes()
+        q_values = self._q_values.get(key)
+        if q_values is not None:
+            self._q_values.move_to_end(key)
+            self.hits += 1
+            return q_values
+
+        self.misses += 1
+        q_values = self._Model.predict_one(state)
+        q_values.flags.writeable = False  # shared by every lookup of the state
+        self._q_values[key] = q_values
+        if len(self._q_values) > self._size_max:
+            self._q_values.popitem(last=False)  # the least recently used state
+            self.evictions += 1
+        return q_values
+
+
+    def invalidate(self):
+        """
+        Drop every cached prediction, e.g. after the weights of the model changed
+        """
+        self._q_values.clear()
+        self._weights_version = self._model_version()
+
+
+    def counters(self):
+        """
+        Return a summary of the hits, misses and evictions so far
+        """
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        return "hits: %d - misses: %d (hit rate %.1f%%) - evictions: %d" % (self.hits, self.misses, hit_rate,
+                                                                           self.evictions)
+
+
+    def __getattr__(self, name):
+        # _Model itself is not set yet while the cache is unpickled or copied, it must not be looked up again
+        if name == '_Model' or name.startswith('__'):
+            raise AttributeError(name)
+        # everything else, training included, goes to the model itself
+        return getattr(self._Model, name)
@@ -0,0 +1,129 @@
+from sumo_backend import traci
+import traci.constants as tc
+import numpy as np
+
+
+class Collector:
+    def __init__(self, Map_info):
+        self._roads = list(Map_info.roads)
+        self._lanes = [lane_id for group in Map_info.lane_groups for lane_id in group]
+
+        # index of the lane group every subscribed lane belongs to
+        self._lane_group_index = np.array([i for i, group in enumerate(Map_info.lane_groups) for _ in group],
+                                          dtype=np.intp)
+
+        self._lane_halting = np.zeros(len(self._lanes))
+        self._edge_halting = np.zeros(len(self._roads))
+        self._edge_CO2 = np.zeros(len(self._roads))
+        self._edge_fuel = np.zeros(len(self._roads))
+
+    def subscribe(self):
+        """
+        Register the lanes of every lane group and the incoming roads, must be called once per episode after sumo starts
+        """
+        for lane_id in self._lanes:
+            traci.lane.subscribe(lane_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER])
+
+        for edge_id in self._roads:
+            traci.edge.subscribe(edge_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER, tc.VAR_CO2EMISSION,
+                                           tc.VAR_FUELCONSUMPTION, tc.LAST_STEP_VEHICLE_ID_LIST])
+
+        traci.simulation.subscribe([tc.VAR_MIN_EXPECTED_VEHICLES])
+
+        self.update()
+
+    def update(self):
+        """
+        Copy the subscription results of the last simulation step into the metric arrays
+        """
+        lane_results = traci.lane.getAllSubscriptionResults()
+        for i, lane_id in enumerate(self._lanes):
+            self._lane_halting[i] = lane_results[lane_id][tc.LAST_STEP_VEHICLE_HALTING_NUMBER]
+
+        edge_results = traci.edge.getAllSubscriptionResults()
+        for i, edge_id in enumerate(self._roads):
+            result = edge_results[edge_id]
+            self._edge_halting[i] = result[tc.LAST_STEP_VEHICLE_HALTING_NUMBER]
+            self._edge_CO2[i] = result[tc.VAR_CO2EMISSION]
+            self._edge_fuel[i] = result[tc.VAR_FUELCONSUMPTION]
+
+    def vehicles_on_roads(self):
+        """
+        Ids of the cars that are in the incoming roads
+        """
+        edge_results = traci.edge.getAllSubscriptionResults()
+        car_ids = set()
+        for edge_id in self._roads:
+            car_ids.update(edge_results[edge_id][tc.LAST_STEP_VEHICLE_ID_LIST])
+        return car_ids
+
+    def network_empty(self):
+        """
+        Whether no car is running in the network nor waiting to be inserted
+        """
+        return traci.simulation.getSubscriptionResults()[tc.VAR_MIN_EXPECTED_VEHICLES] == 0
+
+    def state(self, num_states):
+        """
+        Number of halted cars in every lane group
+        """
+        return np.bincount(self._lane_group_index, weights=self._lane_halting, minlength=num_states)
+
+    def queue_length(self):
+        """
+        Number of halted cars in the incoming roads
+        """
+        return int(self._edge_halting.sum())
+
+    def CO2(self):
+        """
+        CO2 emission in the incoming roads
+        """
+        return self._edge_CO2.sum()
+
+    def fuel(self):
+        """
+        Fuel consumption in the incoming roads
+        """
+        return self._edge_fuel.sum()
+
+
+class WaitingTimeTracker:
+    def __init__(self, Collector):
+        self._Collector = Collector
+        self._tracked = set()
+        self.waiting_times = {}
+        self.all_cars_waiting_time = {}
+
+    def reset(self):
+        """
+        Forget the cars of the previous episode, the subscriptions are dropped by sumo when it restarts
+        """
+        self._tracked = set()
+        self.waiting_times = {}
+
+    def collect(self):
+        """
+        Retrieve the waiting time of every car in the incoming roads, querying only the cars that are in them
+        """
+        on_roads = self._Collector.vehicles_on_roads()
+        alive = traci.vehicle.getAllSubscriptionResults()
+
+        for car_id in self._tracked - on_roads:
+            # a car that was tracked has cleared the intersection, a car that has arrived keeps its last value
+            if car_id in alive:
+                traci.vehicle.unsubscribe(car_id)
+                del self.waiting_times[car_id]
+            self._tracked.discard(car_id)
+
+        for car_id in on_roads - self._tracked:
+            traci.vehicle.subscribe(car_id, [tc.VAR_ACCUMULATED_WAITING_TIME])
+            self._tracked.add(car_id)
+
+        results = traci.vehicle.getAllSubscriptionResults()
+        for car_id in on_roads:
+            wait_time = results[car_id][tc.VAR_ACCUMULATED_WAITING_TIME]
+            self.all_cars_waiting_time[car_id] = wait_time
+            self.waiting_times[car_id] = wait_time
+
+        return sum(self.waiting_times.values())
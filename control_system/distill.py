@@ -0,0 +1,299 @@
+import argparse
+import os
+import timeit
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from inference import NumpyModel
+from Map import Map
+from utils import import_test_configuration, set_backend, set_test_path
+
+VEHICLE_GAP = 7.5  # default sumo car length plus minimum gap, in meters
+
+
+def lane_capacities(net_file, lane_groups, vehicle_gap=VEHICLE_GAP):
+    """
+    Return the most halting cars each lane group can hold, which bounds every component of the state
+    """
+    lengths = {lane.get('id'): float(lane.get('length')) for lane in ET.parse(net_file).getroot().iter('lane')}
+    return np.array([sum(int(lengths[lane_id] // vehicle_gap) for lane_id in group) for group in lane_groups])
+
+
+def sample_states(capacities, n, rng, recorded=None):
+    """
+    Sample n states within the capacities: uniform ones, light traffic ones skewed towards empty lanes,
+    and, for half of them when there are any, recorded ones with a car added or removed here and there
+    """
+    n_recorded = n // 2 if recorded is not None and len(recorded) else 0
+    n_uniform = (n - n_recorded) // 2
+    n_light = n - n_recorded - n_uniform
+
+    uniform = rng.integers(0, capacities + 1, (n_uniform, len(capacities)))
+    light = np.floor((capacities + 1) * rng.random((n_light, len(capacities))) ** 3)
+    parts = [uniform, light]
+    if n_recorded:
+        jitter = rng.integers(-1, 2, (n_recorded, len(capacities)))
+        parts.append(recorded[rng.integers(0, len(recorded), n_recorded)] + jitter)
+
+    return np.clip(np.concatenate(parts), 0, capacities).astype(np.int64)
+
+
+class TablePolicy:
+    """
+    Action of every state of the bounded state space, indexed with the halting counts as mixed-radix digits
+    """
+    def __init__(self, capacities, actions):
+        self._capacities = np.asarray(capacities)
+        self._actions = np.asarray(actions)
+
+    @classmethod
+    def distill(cls, network_actions, capacities, num_actions, max_size=10 ** 7, chunk=100000):
+        """
+        Enumerate the whole state space and store the best action of the network for each state,
+        given by network_actions(states), in the smallest unsigned integers that hold num_actions actions
+        """
+        size = int(np.prod(np.asarray(capacities, dtype=np.float64) + 1))
+        if size > max_size:
+            raise ValueError("The state space has %d states, more than the %d a table can hold" % (size, max_size))
+
+        actions = np.empty(size, dtype=np.min_scalar_type(num_actions - 1))
+        for start in range(0, size, chunk):
+            states = np.stack(np.unravel_index(np.arange(start, min(start + chunk, size)), np.asarray(capacities) + 1), 1)
+            actions[start:start + len(states)] = network_actions(states)
+        return cls(capacities, actions)
+
+    def choose_action(self, state):
+        # the halting counts of the collector are floats, the digits of the index must be integers
+        digits = np.minimum(np.asarray(state, dtype=np.int64), self._capacities)
+        return int(self._actions[np.ravel_multi_index(digits, self._capacities + 1)])
+
+    def predict_actions(self, states):
+        digits = np.minimum(np.asarray(states, dtype=np.int64), self._capacities)
+        return self._actions[np.ravel_multi_index(digits.T, self._capacities + 1)]
+
+    def save(self, path):
+        np.savez(path, kind='table', capacities=self._capacities, actions=self._actions)
+
+    @property
+    def size(self):
+        return len(self._actions)
+
+
+class TreePolicy:
+    """
+    Decision tree over the halting counts, each node sends a state left when one count is at most its threshold
+    """
+    def __init__(self, feature, threshold, left, right, action):
+        self._arrays = (np.asarray(feature), np.asarray(threshold), np.asarray(left), np.asarray(right),
+                        np.asarray(action))
+        # plain lists, walking them one state at a time is faster than indexing arrays
+        self._nodes = list(zip(*(array.tolist() for array in self._arrays)))
+
+    @classmethod
+    def distill(cls, states, actions, num_actions, max_depth=16, min_leaf=5):
+        """
+        Grow a classification tree on the actions of the network, splitting each node where the gini impurity
+        decreases the most
+        """
+        feature, threshold, left, right, action = [], [], [], [], []
+
+        def add_leaf(node_actions):
+            feature.append(-1)
+            threshold.append(0)
+            left.append(-1)
+            right.append(-1)
+            action.append(int(np.bincount(node_actions, minlength=num_actions).argmax()))
+            return len(feature) - 1
+
+        root = add_leaf(actions)
+        stack = [(root, np.arange(len(states)), 0)]
+        while stack:
+            node, rows, depth = stack.pop()
+            if depth >= max_depth or len(rows) < 2 * min_leaf or np.all(actions[rows] == actions[rows[0]]):
+                continue
+
+            split = cls._best_split(states[rows], actions[rows], num_actions, min_leaf)
+            if split is None:
+                continue
+
+            split_feature, split_threshold = split
+            goes_left = states[rows, split_feature] <= split_threshold
+            feature[node] = split_feature
+            threshold[node] = split_threshold
+            left[node] = add_leaf(actions[rows[goes_left]])
+            right[node] = add_leaf(actions[rows[~goes_left]])
+            stack.append((left[node], rows[goes_left], depth + 1))
+            stack.append((right[node], rows[~goes_left], depth + 1))
+
+        return cls(feature, threshold, left, right, action)
+
+    @staticmethod
+    def _best_split(states, actions, num_actions, min_leaf):
+        """
+        Return the feature and threshold with the lowest weighted gini impurity, None if no split helps
+        """
+        n = len(actions)
+        one_hot = np.eye(num_actions)[actions]
+        totals = one_hot.sum(axis=0)
+        best_score = n - (totals ** 2).sum() / n  # impurity of the node itself, times n
+        best = None
+
+        for f in range(states.shape[1]):
+            order = np.argsort(states[:, f], kind='stable')
+            values = states[order, f]
+            counts_left = np.cumsum(one_hot[order], axis=0)[:-1]
+            n_left = np.arange(1, n)
+
+            # only between two different values, leaving at least min_leaf states on each side
+            valid = (values[:-1] != values[1:]) & (n_left >= min_leaf) & (n - n_left >= min_leaf)
+            if not valid.any():
+                continue
+
+            counts_left, n_left, positions = counts_left[valid], n_left[valid], np.flatnonzero(valid)
+            counts_right = totals - counts_left
+            scores = (n_left - (counts_left ** 2).sum(axis=1) / n_left) + \
+                     ((n - n_left) - (counts_right ** 2).sum(axis=1) / (n - n_left))
+
+            i = scores.argmin()
+            if scores[i] < best_score - 1e-9:
+                best_score = scores[i]
+                best = (f, int(values[positions[i]]))
+
+        return best
+
+    def choose_action(self, state):
+        node = self._nodes[0]
+        while node[0] >= 0:
+            node = self._nodes[node[2] if state[node[0]] <= node[1] else node[3]]
+        return node[4]
+
+    def predict_actions(self, states):
+        feature, threshold, left, right, action = self._arrays
+        nodes = np.zeros(len(states), dtype=np.int64)
+        active = feature[nodes] >= 0
+        while active.any():
+            current = nodes[active]
+            goes_left = states[active, feature[current]] <= threshold[current]
+            nodes[active] = np.where(goes_left, left[current], right[current])
+            active = feature[nodes] >= 0
+        return action[nodes]
+
+    def save(self, path):
+        feature, threshold, left, right, action = self._arrays
+        np.savez(path, kind='tree', feature=feature, threshold=threshold, left=left, right=right, action=action)
+
+    @property
+    def size(self):
+        return len(self._nodes)
+
+
+def load_policy(model_folder_path):
+    """
+    Load the policy distilled from the model of the folder
+    """
+    with np.load(os.path.join(model_folder_path, 'policy.npz')) as content:
+        if content['kind'] == 'table':
+            return TablePolicy(content['capacities'], content['actions'])
+        return TreePolicy(content['feature'], content['threshold'], content['left'], content['right'],
+                          content['action'])
+
+
+def evaluate(config, Model):
+    """
+    Run the test episode of Test.py with the given model or policy, return its metrics
+    """
+    from generate_traffic import Traffic_Generator
+    from Test import Test
+    from utils import set_sumo
+
+    sumo_cmd = set_sumo(False, config['simulation_folder'], config['sumocfg_file_name'], config['max_steps'])
+    Tester = Test(Model, Map(config['map']),
+                  Traffic_Generator(config['flow_file'], config['route_file'], config['n_cars_generated'],
+                                    config['simulation_time'], config['compact_routes'],
+                                    config['direct_injection']),
+                  sumo_cmd, config['max_steps'], config['green_duration'], config['yellow_duration'],
+                  config['num_states'], config['num_actions'], branching=config['branching'])
+    simulation_time = Tester.run(config['episode_seed'])
+
+    rewards = np.array(Tester.reward_episode)
+    return {
+        'negative reward': float(rewards[rewards < 0].sum()),
+        'average queue length': round(float(np.mean(Tester.queue_length_episode)), 2),
+        'average waiting time': round(float(np.mean(Tester.waiting_times)), 2),
+        'simulation time': simulation_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill the tested model into a lookup table or a decision tree")
+    parser.add_argument("--kind", choices=["tree", "table"], default="tree")
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--max-depth", type=int, default=16)
+    parser.add_argument("--min-leaf", type=int, default=5)
+    parser.add_argument("--evaluate", action="store_true", help="also compare the test episode of both policies")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = import_test_configuration(config_file='settings/testing_settings.ini')
+    model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'])
+    rng = np.random.default_rng(args.seed)
+
+    Model = NumpyModel(config['num_states'], model_path)
+    Map_info = Map(config['map'])
+    capacities = lane_capacities(config['net_file'], Map_info.lane_groups)
+
+    def network_actions(states):
+        return Map_info.greedy_actions(Model.predict_batch(states), config['branching'])
+
+    states_file = os.path.join(plot_path, 'states.npy')
+    recorded = np.load(states_file) if os.path.isfile(states_file) else None
+    print("Lane group capacities:", capacities.tolist())
+
+    start_time = timeit.default_timer()
+    if args.kind == 'table':
+        Policy = TablePolicy.distill(network_actions, capacities, config['num_actions'])
+    else:
+        states = sample_states(capacities, args.samples, rng, recorded)
+        Policy = TreePolicy.distill(states, network_actions(states), config['num_actions'],
+                                    args.max_depth, args.min_leaf)
+    print("Distilled a", args.kind, "of", Policy.size, "entries in", round(timeit.default_timer() - start_time, 1), "s")
+
+    Policy.save(os.path.join(model_path, 'policy.npz'))
+
+    held_out = sample_states(capacities, args.samples, rng, recorded).astype(np.float64)  # like the collector states
+    checks = [('held-out sampled states', held_out)] + ([('recorded states', recorded)] if recorded is not None else [])
+    for name, states in checks:
+        q_values = Model.predict_batch(states)
+        actions = Policy.predict_actions(states)
+        best_actions = Map_info.greedy_actions(q_values, config['branching'])
+        agreement = np.mean(actions == best_actions)
+        # how much value the policy gives up when it disagrees, in the units of the q-values
+        regret = np.mean(Map_info.action_values(q_values, best_actions, config['branching']) -
+                         Map_info.action_values(q_values, actions, config['branching']))
+        print("Agreement on %d %s: %.2f%% - mean q-value regret: %.2f" % (len(states), name, 100 * agreement, regret))
+
+    # Test.py takes its decisions one float state at a time, they must match the batched predictions
+    decisions = [Policy.choose_action(state) for state in held_out[:1000]]
+    assert np.array_equal(decisions, Policy.predict_actions(held_out[:1000])), "choose_action disagrees with the batch"
+
+    start_time = timeit.default_timer()
+    for state in held_out[:10000]:
+        Policy.choose_action(state)
+    print("Policy decision time: %.1f us" % (1e6 * (timeit.default_timer() - start_time) / len(held_out[:10000])))
+
+    start_time = timeit.default_timer()
+    for state in held_out[:10000]:
+        Model.predict_one(state)
+    print("Network decision time: %.1f us" % (1e6 * (timeit.default_timer() - start_time) / len(held_out[:10000])))
+
+    # the policy only approximates the network, Test.py uses it when inference = policy is set explicitly
+    if args.evaluate:
+        set_backend(False, config['backend'])
+        metrics = {name: evaluate(config, Decider) for name, Decider in [('network', Model), ('policy', Policy)]}
+        print("Test episode: %-22s %12s %12s" % ('', 'network', 'policy'))
+        for metric in metrics['network']:
+            print("              %-22s %12s %12s" % (metric, metrics['network'][metric], metrics['policy'][metric]))
+    else:
+        print("The policy was not tested, run with --evaluate to compare its test episode with the network's")
+    print("Saved at", os.path.join(model_path, 'policy.npz'), "- Test.py only uses it with inference = policy")
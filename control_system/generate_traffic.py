@@ -1,18 +1,22 @@
-from xml.dom import minidom
-from xml.dom.minidom import Node, Document
+from xml.sax.saxutils import quoteattr
 import numpy as np
 import json
 
+from sumo_backend import traci
+
 
 class Traffic_Generator:
 
-	def __init__(self, CONNECTION_FILE, OUT_FILE, CAR_NUMBER, SIMULATION_TIME):
+	def __init__(self, CONNECTION_FILE, OUT_FILE, CAR_NUMBER, SIMULATION_TIME, COMPACT_ROUTES=False,
+				 DIRECT_INJECTION=False):
 
 		
 		self.CONNECTION_FILE = CONNECTION_FILE
 		self.OUT_FILE = OUT_FILE
 		self.CAR_NUMBER = CAR_NUMBER
 		self.SIMULATION_TIME = SIMULATION_TIME # in seconds
+		self.COMPACT_ROUTES = COMPACT_ROUTES # each distinct path written once, as a route the vehicles refer to
+		self.DIRECT_INJECTION = DIRECT_INJECTION # the cars stay in memory and are added through traci when due
 
 		#self.CONNECTION_FILE = "traffic_flow/ain_naadja_flow.json"
 		#self.OUT_FILE = "ain_naadja.rou.xml"
@@ -21,41 +25,34 @@ class Traffic_Generator:
 		self.arrival_rate = self.CAR_NUMBER/ self.SIMULATION_TIME
 
 		self.EMERGENCY_PROBABILITY = 0.005
+		self.TYPES = ["veh_passenger", "veh_emergency"]
 
-		self.doc = None
-		self.connections = {}
-
-		
-
+		# the flow graph is read and compiled once, every episode only draws from it
+		self.connections = self.get_connections(self.CONNECTION_FILE)
+		self.compile_flow()
 
+		# own generator, so that generators of different workers do not share the global numpy state
+		self.rng = np.random.default_rng()
 
-	def initialize_doc(self):
+		# cars of the episode waiting to be injected, next_car being the first one not added to sumo yet
+		self.departs, self.paths, self.path_ids, self.is_emergency = [], [], [], []
+		self.next_car = 0
+		
 
-		doc = Document()
 
-		root = doc.createElement("routes")
-		root.setAttribute("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-		root.setAttribute("xsi:noNamespaceSchemaLocation", "http://sumo.dlr.de/xsd/routes_file.xsd")
 
-		doc.appendChild(root)
+	def write_header(self, file):
+		"""
+		Write the opening of the route file and the vehicle types
+		"""
+		file.write('<?xml version="1.0" ?>\n')
+		file.write('<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+				   'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">\n')
 
 		# add vehicls types
 
-		vType = doc.createElement("vType")
-		vType.setAttribute("id", "veh_passenger")
-		vType.setAttribute("vClass", "passenger")
-
-		root.appendChild(vType)
-
-		vType = doc.createElement("vType")
-		vType.setAttribute("id", "veh_emergency")
-		vType.setAttribute("vClass", "passenger")
-		vType.setAttribute("color", "red")
-		vType.setAttribute("width", "2.5")
-
-		root.appendChild(vType)
-		
-		return doc
+		file.write('\t<vType id="veh_passenger" vClass="passenger"/>\n')
+		file.write('\t<vType id="veh_emergency" vClass="passenger" color="red" width="2.5"/>\n')
 
 
 	def get_connections(self, file):
@@ -74,110 +71,187 @@ class Traffic_Generator:
 		return connections
 
 
-	
-	def choose_start(self):
-		start_edges = self.connections["start"]
+	def compile_flow(self):
+		"""
+		Number the edges and store the cumulative probabilities of the start edges and of the turns of every edge
+		in arrays, the turns of all the edges one after the other
+		"""
+		conn = self.connections
+		start_edges = conn["start"]
 
-		pb = np.random.random()
-		for edge in start_edges:
-			if pb <= float(start_edges[edge]):
-				return edge
+		edges = list(start_edges)
+		for edge in conn:
+			if edge != "start":
+				edges += [edge] + [turn["edge"] for turn in conn[edge]]
+		edges = list(dict.fromkeys(edges))
+		index = {edge: i for i, edge in enumerate(edges)}
 
+		self.edges = np.array(edges)
+		self.start_edges = np.array([index[edge] for edge in start_edges])
+		self.start_probabilities = np.array([float(start_edges[edge]) for edge in start_edges])
 
+		turns = [conn.get(edge, []) for edge in edges]
+		self.turn_counts = np.array([len(edge_turns) for edge_turns in turns])
+		self.first_turns = np.concatenate([[0], np.cumsum(self.turn_counts)[:-1]])
+		self.turn_edges = np.array([index[turn["edge"]] for edge_turns in turns for turn in edge_turns], dtype=np.int64)
 
+		# the probabilities of the turns of edge i are shifted by 2 * i, so that a single searchsorted
+		# looks in the turns of the edge of each car
+		self.turn_probabilities = np.array([2 * i + turn["probability"]
+											for i, edge_turns in enumerate(turns) for turn in edge_turns])
 
-	def generate_path(self):
 
-		start = self.choose_start()
-		path = [start]
-		edge = start
+	
+	def choose_start(self, n_cars):
+		"""
+		Draw the start edges of n_cars cars
+		"""
+		pb = self.rng.random(n_cars)
+		choice = np.searchsorted(self.start_probabilities, pb, side="left")
 
-		conn = self.connections
+		return self.start_edges[np.minimum(choice, len(self.start_edges) - 1)]
 
-		while conn.get(edge):
-			
-			pb = np.random.random()
-			nexts = conn[edge]
 
-			# the probabilities are sorted
-			for i in range(len(nexts)):
 
-				if pb < nexts[i]["probability"] or i == len(nexts) - 1 :
 
+	def generate_paths(self, n_cars):
+		"""
+		Draw the paths of n_cars cars, moving all the cars that have not left the network one edge at a time.
+		Return the distinct paths as lists of edges and the index of the path of each car
+		"""
+		edge = self.choose_start(n_cars)
+		hops = [edge]
+		driving = self.turn_counts[edge] > 0
 
-					edge = nexts[i]["edge"]
-					path.append(edge)
+		while driving.any():
 
-					break
+			current = edge[driving]
+			pb = self.rng.random(len(current))
 
-		return path
+			# the turns are sorted by probability, the last one is taken when none matches
+			turn = np.searchsorted(self.turn_probabilities, 2 * current + pb, side="right") - self.first_turns[current]
+			turn = np.minimum(turn, self.turn_counts[current] - 1)
 
+			edge = np.full(n_cars, -1)
+			edge[driving] = self.turn_edges[self.first_turns[current] + turn]
+			hops.append(edge)
+			driving[driving] = self.turn_counts[edge[driving]] > 0
 
+		paths, path_ids = np.unique(np.stack(hops, axis=1), axis=0, return_inverse=True)
+		paths = [self.edges[path[path >= 0]].tolist() for path in paths]
 
+		return paths, path_ids.reshape(-1)
 
-	def add_cars(self, n_cars, car_id, time):
 
 
-		times = np.random.random(n_cars)
-		times = sorted(list(map(lambda x : np.around(time + x), times)))
 
-		for n in range(n_cars):
+	def generate_departures(self):
+		"""
+		Draw the departure times of the episode, sorted
+		"""
+		# arrivals follow a poisson distribution
+		arrivals = self.rng.poisson(self.arrival_rate, self.SIMULATION_TIME)
+		seconds = np.repeat(np.arange(self.SIMULATION_TIME), arrivals)
+
+		return np.sort(np.around(seconds + self.rng.random(len(seconds))))
 
-			
-			path = " ".join(self.generate_path())
 
-			vehicle = self.doc.createElement("vehicle")
-			vehicle.setAttribute("id", "veh" + str(car_id + n))
 
-			is_emergency = np.random.random()
+	def add_cars(self, file, departs, paths, path_ids, is_emergency):
+		"""
+		Write the vehicles one after the other without building the document in memory, each with its route
+		or, with compact routes, after the distinct paths as named routes the vehicles refer to
+		"""
+		routes = [quoteattr(" ".join(path)) for path in paths]
+		types = self.TYPES
+		cars = enumerate(zip(departs.tolist(), path_ids.tolist(), is_emergency.tolist()))
 
-			if is_emergency < self.EMERGENCY_PROBABILITY :
-				vehicle.setAttribute("type", "veh_emergency")
-			else:
-				vehicle.setAttribute("type", "veh_passenger")
+		if self.COMPACT_ROUTES:
 
-			vehicle.setAttribute("depart", str(times[n]))
-			vehicle.setAttribute("departLane", "best")
-			vehicle.setAttribute("departSpeed", "max")
+			for path_id, route in enumerate(routes):
+				file.write('\t<route id="route%d" edges=%s/>\n' % (path_id, route))
 
-			roote = self.doc.createElement("route")
-			roote.setAttribute("edges", path)
+			for n, (depart, path_id, emergency) in cars:
+				file.write('\t<vehicle id="veh%d" type="%s" route="route%d" depart="%s" departLane="best" '
+						   'departSpeed="max"/>\n' % (n, types[emergency], path_id, depart))
 
-			vehicle.appendChild(roote)
-			self.doc.documentElement.appendChild(vehicle)
+			return
+
+		for n, (depart, path_id, emergency) in cars:
+
+			file.write('\t<vehicle id="veh%d" type="%s" depart="%s" departLane="best" departSpeed="max">\n'
+					   '\t\t<route edges=%s/>\n'
+					   '\t</vehicle>\n' % (n, types[emergency], depart, routes[path_id]))
 
 
 		
 	def generate_cars(self):
+		"""
+		Draw the departure time, path and type of every car of the episode at once
+		"""
+		departs = self.generate_departures()
+		paths, path_ids = self.generate_paths(len(departs))
+		is_emergency = self.rng.random(len(departs)) < self.EMERGENCY_PROBABILITY
+
+		return departs, paths, path_ids, is_emergency
 
-		car_id = 0
-		time = 0
 
-		# arrivals follow a poisson distribution
-		arrivals = np.random.poisson(self.arrival_rate, self.SIMULATION_TIME)
 
-		for n_cars in arrivals:
+	def generate_traffic(self, seed):
 
-			self.add_cars(n_cars, car_id, time)
+		self.rng = np.random.default_rng(seed)
 
-			car_id += n_cars
-			time += 1
+		if self.DIRECT_INJECTION:
 
+			departs, self.paths, path_ids, is_emergency = self.generate_cars()
+			self.departs, self.path_ids, self.is_emergency = departs.tolist(), path_ids.tolist(), is_emergency.tolist()
+			self.next_car = 0
 
+			# sumo still loads a route file, it only holds the vehicle types
+			with open(self.OUT_FILE, 'w') as file :
+				self.write_header(file)
+				file.write('</routes>\n')
 
-	def generate_traffic(self, seed):
+			return
+
+		# the vehicles go to the file as they are written, through its buffer
+		with open(self.OUT_FILE, 'w', buffering=1 << 20) as file :
+			self.write_header(file)
+			self.add_cars(file, *self.generate_cars())
+			file.write('</routes>\n')
 
-		np.random.seed(seed)
 
-		self.doc = self.initialize_doc()
-		self.connections = self.get_connections(self.CONNECTION_FILE)
 
-		self.generate_cars()
+	def register_routes(self):
+		"""
+		Add the distinct paths of the episode to sumo as routes, after every start or reload of sumo
+		"""
+		if self.DIRECT_INJECTION:
 
-		xml_file = self.doc.toprettyxml()
+			for path_id, path in enumerate(self.paths):
+				traci.route.add("route%d" % path_id, path)
 
-		with open(self.OUT_FILE, 'w') as file :
-			file.write(xml_file)
+
+
+	def inject(self, time):
+		"""
+		Add to sumo the cars departing at or before time, the current simulation time, in departure order
+		"""
+		while self.next_car < len(self.departs) and self.departs[self.next_car] <= time:
+
+			n = self.next_car
+			traci.vehicle.add("veh%d" % n, "route%d" % self.path_ids[n], self.TYPES[self.is_emergency[n]],
+							  depart=str(self.departs[n]), departLane="best", departSpeed="max")
+			self.next_car += 1
+
+
+
+	@property
+	def pending(self):
+		"""
+		Number of cars of the episode not injected yet
+		"""
+		return len(self.departs) - self.next_car
 
 
 
@@ -191,4 +265,3 @@ if __name__ == "__main__":
 
 	t = Traffic_Generator(CONNECTION_FILE, OUT_FILE, CAR_NUMBER, SIMULATION_TIME)
 	t.generate_traffic(5)
-
@@ -0,0 +1,117 @@
+import os
+import sys
+
+import numpy as np
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+
+def weights_file(model_folder_path, precision='float32'):
+    """
+    Path of the exported weights of the given precision
+    """
+    suffix = '' if precision == 'float32' else '_' + precision
+    return os.path.join(model_folder_path, 'trained_model' + suffix + '.npz')
+
+
+def export_weights(model_folder_path):
+    """
+    Export the dense layers of the trained_model.h5 of the folder in every precision
+    """
+    # imported here so that running an exported model never loads tensorflow
+    from tensorflow.keras.models import load_model
+
+    model_file_path = os.path.join(model_folder_path, 'trained_model.h5')
+    if not os.path.isfile(model_file_path):
+        sys.exit("Model number not found")
+
+    weights = load_model(model_file_path, compile=False).get_weights()
+    for precision in PRECISIONS:
+        save_weights(model_folder_path, weights, precision)
+
+
+def save_weights(model_folder_path, weights, precision='float32'):
+    """
+    Save the kernels and biases of the dense layers, in the order of the layers, in the given precision:
+    float16 halves the kernels, int8 quantizes each column of a kernel with its own scale, the biases stay float32
+    """
+    arrays = {}
+    for i, (kernel, bias) in enumerate(zip(weights[0::2], weights[1::2])):
+        if precision == 'int8':
+            scale = np.abs(kernel).max(axis=0) / 127
+            scale[scale == 0] = 1
+            arrays['kernel_' + str(i)] = np.round(kernel / scale).astype(np.int8)
+            arrays['scale_' + str(i)] = scale.astype(np.float32)
+        else:
+            arrays['kernel_' + str(i)] = kernel.astype(precision)
+        arrays['bias_' + str(i)] = bias.astype(np.float32)
+
+    np.savez(weights_file(model_folder_path, precision), **arrays)
+
+
+def load_weights(weights_file_path):
+    """
+    Load the exported weights as a list of (kernel, scale, bias) per layer, the scale is None unless quantized
+    """
+    with np.load(weights_file_path) as content:
+        return [(content['kernel_' + str(i)], content.get('scale_' + str(i)), content['bias_' + str(i)])
+                for i in range(sum(name.startswith('kernel_') for name in content.files))]
+
+
+class NumpyModel:
+    """
+    Forward pass of the trained fully connected network with plain matrix products: relu on every hidden layer,
+    linear output, the same predictions as TestModel without tensorflow. The int8 kernels stay quantized in memory,
+    a quarter of the float32 ones, they are widened one layer at a time and their scales are applied to the output
+    of the layer. The float16 kernels are widened to float32 when they are loaded, numpy converts float16 too slowly
+    to do it at every decision, so that export only makes the file smaller
+    """
+    def __init__(self, input_dim, model_path, precision='float32'):
+        self._input_dim = input_dim
+        self._layers = self._load_my_model(model_path, precision)
+
+
+    def _load_my_model(self, model_folder_path, precision):
+        """
+        Load the exported weights of the folder, exporting them from the h5 model the first time
+        """
+        if not os.path.isfile(weights_file(model_folder_path, precision)):
+            export_weights(model_folder_path)
+
+        return [(kernel.astype(np.float32) if kernel.dtype == np.float16 else kernel, scale, bias)
+                for kernel, scale, bias in load_weights(weights_file(model_folder_path, precision))]
+
+
+    def predict_batch(self, states):
+        """
+        Predict the action values from a batch of states
+        """
+        x = np.asarray(states, dtype=np.float32)
+        for i, (kernel, scale, bias) in enumerate(self._layers):
+            x = x @ kernel.astype(np.float32, copy=False)
+            if scale is not None:
+                x *= scale  # the scale of a column of the kernel is the scale of an output of the layer
+            x += bias
+            if i < len(self._layers) - 1:
+                x = np.maximum(x, 0)
+        return x
+
+
+    def predict_one(self, state):
+        """
+        Predict the action values from a single state
+        """
+        return self.predict_batch(np.reshape(state, [1, self._input_dim]))
+
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the weights
+        """
+        return sum(array.nbytes for layer in self._layers for array in layer if array is not None)
+
+
+    @property
+    def input_dim(self):
+        return self._input_dim
@@ -0,0 +1,77 @@
+import contextlib
+import threading
+
+
+class Learner(threading.Thread):
+    def __init__(self, replay, Model):
+        super().__init__(daemon=True)
+        self._replay = replay
+        self._Model = Model
+        self._stop_event = threading.Event()
+        self._sync_requested = threading.Event()
+        self._lock = threading.Lock()
+        self._step_lock = threading.Lock()  # held during a gradient step
+        self._weights = Model.get_weights()
+        self._version = 0
+        self._gradient_steps = 0
+        self._error = None  # what stopped the thread, raised again in the actor
+
+    def run(self):
+        """
+        Train the model continuously, publishing a copy of its weights whenever the actor asks for one
+        """
+        try:
+            while not self._stop_event.is_set():
+                if self._sync_requested.is_set():
+                    self._sync_requested.clear()
+                    self._publish()
+
+                with self._step_lock:
+                    trained = self._replay()
+                if trained:
+                    self._gradient_steps += 1
+                else:
+                    self._stop_event.wait(0.01)  # the memory is not full enough yet
+        except Exception as error:
+            # the actor would otherwise keep simulating with stale weights
+            self._error = error
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _publish(self):
+        """
+        Snapshot the weights between two gradient steps
+        """
+        weights = self._Model.get_weights()
+        with self._lock:
+            self._weights = weights
+            self._version += 1
+
+    def latest_weights(self):
+        """
+        Return the last published weights with their version, and ask for fresher ones,
+        raise the error that stopped the learner if it failed
+        """
+        self._raise_error()
+        self._sync_requested.set()
+        with self._lock:
+            return self._version, self._weights
+
+    @contextlib.contextmanager
+    def paused(self):
+        """
+        Keep the learner between two gradient steps, e.g. while the model is saved
+        """
+        with self._step_lock:
+            yield
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self._raise_error()
+
+    @property
+    def gradient_steps(self):
+        return self._gradient_steps
@@ -1,36 +1,425 @@
-import random
+import json
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+COLUMNS = ('states', 'actions', 'rewards', 'next_states')
+
 
 class Memory:
-    def __init__(self, size_max, size_min):
-        self._samples = []
+    def __init__(self, size_max, size_min, state_dtype=np.uint16):
         self._size_max = size_max
         self._size_min = size_min
+        self._state_dtype = state_dtype  # the states are halting counts, small integers
+        self._lock = threading.Lock()  # the learner thread samples while the actor adds samples
+        self._rng = np.random.default_rng()
+
+        # circular buffer, the columns are allocated with the first sample
+        self._states = None
+        self._actions = None
+        self._rewards = None
+        self._next_states = None
+        self._index = 0  # where the next sample is written
+        self._size = 0
+
+
+    def _allocate(self, state_shape):
+        """
+        Allocate the columns of the buffer for states of the given shape
+        """
+        self._states = np.zeros((self._size_max,) + state_shape, dtype=self._state_dtype)
+        self._actions = np.zeros(self._size_max, dtype=np.int32)
+        self._rewards = np.zeros(self._size_max, dtype=np.float32)
+        self._next_states = np.zeros((self._size_max,) + state_shape, dtype=self._state_dtype)
+
+
+    def save(self, folder):
+        """
+        Write a snapshot of the memory into the folder, a .npy file per column and the position in the buffer
+        """
+        os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            self._save(folder)
+
+
+    def _save(self, folder):
+        if self._states is not None:
+            for name in COLUMNS:
+                np.save(os.path.join(folder, name + '.npy'), getattr(self, '_' + name)[:self._size])
+
+        with open(os.path.join(folder, 'replay.json'), 'w') as file:
+            json.dump({'index': self._index, 'size': self._size}, file)
+
+
+    def restore(self, folder):
+        """
+        Load the snapshot saved in the folder by a previous session, return whether there was one
+        """
+        position_file = os.path.join(folder, 'replay.json')
+        if not os.path.isfile(position_file):
+            return False
+
+        with open(position_file) as file:
+            position = json.load(file)
+
+        with self._lock:
+            self._restore(folder, position)
+        return True
+
+
+    def _restore(self, folder, position):
+        self._index = position['index']
+        self._size = position['size']
+        if self._size:
+            columns = {name: np.load(os.path.join(folder, name + '.npy')) for name in COLUMNS}
+            self._allocate(columns['states'].shape[1:])
+            for name, column in columns.items():
+                getattr(self, '_' + name)[:self._size] = column
 
 
     def add_sample(self, sample):
         """
-        Add a sample into the memory
+        Add a sample into the memory, once it is full the oldest sample is overwritten
+        """
+        with self._lock:
+            self._store(sample)
+
+
+    def _store(self, sample):
         """
-        self._samples.append(sample)
-        if self._size_now() > self._size_max:
-            self._samples.pop(0)  # if the length is greater than the size of memory, remove the oldest element
+        Write a sample in the next slot of the buffer and return the slot
+        """
+        state, action, reward, next_state = sample
+
+        if self._states is None:
+            self._allocate(np.shape(state))
+
+        index = self._index
+        self._states[index] = state
+        self._actions[index] = action
+        self._rewards[index] = reward
+        self._next_states[index] = next_state
+
+        self._index = (index + 1) % self._size_max
+        self._size = min(self._size + 1, self._size_max)
+        return index
 
 
     def get_samples(self, n):
         """
-        Get n samples randomly from the memory
+        Get n samples randomly from the memory, as contiguous arrays of states, actions, rewards and next states
+        ready to be fed to the nn, followed by their slots and importance-sampling weights (None when uniform)
         """
-        if self._size_now() < self._size_min:
-            return []
+        with self._lock:
+            if self._size_now() == 0 or self._size_now() < self._size_min:
+                return None
 
-        if n > self._size_now():
-            return random.sample(self._samples, self._size_now())  # get all the samples
-        else:
-            return random.sample(self._samples, n)  # get "batch size" number of samples
+            n = min(n, self._size_now())  # get all the samples or "batch size" number of samples
+            indices = self._rng.choice(self._size_now(), n, replace=False)
+
+            return self._batch(indices) + (indices, None)
+
+
+    def _batch(self, indices):
+        """
+        Gather the samples stored in the given slots
+        """
+        return (self._states[indices].astype(np.float32), self._actions[indices], self._rewards[indices],
+                self._next_states[indices].astype(np.float32))
+
+
+    def update_priorities(self, indices, errors):
+        """
+        Uniform sampling does not use the td errors
+        """
+        pass
 
 
     def _size_now(self):
         """
         Check how full the memory is
         """
-        return len(self._samples)
\ No newline at end of file
+        return self._size
+
+
+
+class SumTree:
+    def __init__(self, capacity):
+        self._leaves = 1 << max(capacity - 1, 1).bit_length()  # the leaves hold the priorities
+        self._depth = self._leaves.bit_length() - 1
+        self._tree = np.zeros(2 * self._leaves)  # node i has children 2i and 2i + 1, the root is node 1
+
+
+    def update(self, index, priority):
+        """
+        Set the priority of one leaf, then recompute the sums along its path to the root in O(log n)
+        """
+        node = index + self._leaves
+        self._tree[node] = priority
+        node //= 2
+        while node >= 1:
+            self._tree[node] = self._tree[2 * node] + self._tree[2 * node + 1]
+            node //= 2
+
+
+    def update_batch(self, indices, priorities):
+        """
+        Set the priorities of several leaves, the parents of a level are recomputed together
+        """
+        nodes = np.asarray(indices) + self._leaves
+        self._tree[nodes] = priorities
+        for _ in range(self._depth):
+            nodes = np.unique(nodes // 2)
+            self._tree[nodes] = self._tree[2 * nodes] + self._tree[2 * nodes + 1]
+
+
+    def find(self, values):
+        """
+        Return the leaves where the given cumulative priorities fall, descending the tree for all values at once
+        """
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self._depth):
+            left = 2 * nodes
+            go_right = values > self._tree[left]
+            values = np.where(go_right, values - self._tree[left], values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self._leaves
+
+
+    def priorities(self, indices):
+        return self._tree[np.asarray(indices) + self._leaves]
+
+
+    @property
+    def total(self):
+        return self._tree[1]
+
+
+class PrioritizedMemory(Memory):
+    def __init__(self, size_max, size_min, alpha, beta, state_dtype=np.uint16):
+        super().__init__(size_max, size_min, state_dtype)
+        self._alpha = alpha  # how much the td errors shape the sampling, 0 is uniform
+        self._beta = beta  # how much the importance-sampling weights correct the bias, 1 is fully
+        self._epsilon = 1e-3  # keep every sample reachable
+        self._max_priority = 1.0
+        self._tree = SumTree(size_max)
+
+
+    def add_sample(self, sample):
+        """
+        Add a sample into the memory with the highest priority so far, so that it is replayed at least once
+        """
+        with self._lock:
+            index = self._store(sample)
+            self._tree.update(index, self._max_priority ** self._alpha)
+
+
+    def get_samples(self, n):
+        """
+        Get n samples with a probability proportional to their priority, one in each of n equal priority segments,
+        followed by their slots and normalized importance-sampling weights
+        """
+        with self._lock:
+            if self._size_now() == 0 or self._size_now() < self._size_min:
+                return None
+
+            n = min(n, self._size_now())
+            total = self._tree.total
+            values = (np.arange(n) + self._rng.random(n)) * (total / n)
+            indices = np.minimum(self._tree.find(values), self._size_now() - 1)
+
+            probabilities = self._tree.priorities(indices) / total
+            weights = (self._size_now() * probabilities) ** -self._beta
+            weights = (weights / weights.max()).astype(np.float32)
+
+            return self._batch(indices) + (indices, weights)
+
+
+    def update_priorities(self, indices, errors):
+        """
+        Use the absolute td errors of the replayed samples as their new priorities
+        """
+        priorities = np.abs(errors) + self._epsilon
+        with self._lock:
+            self._max_priority = max(self._max_priority, priorities.max())
+            self._tree.update_batch(indices, priorities ** self._alpha)
+
+
+    def _save(self, folder):
+        super()._save(folder)
+        np.savez(os.path.join(folder, 'priorities.npz'), priorities=self._tree.priorities(np.arange(self._size)),
+                 max_priority=self._max_priority)
+
+
+    def _restore(self, folder, position):
+        super()._restore(folder, position)
+        with np.load(os.path.join(folder, 'priorities.npz')) as content:
+            self._tree.update_batch(np.arange(self._size), content['priorities'])
+            self._max_priority = float(content['max_priority'])
+
+
+
+class SharedReplayMemory(Memory):
+    def __init__(self, size_max, size_min, state_shape, state_dtype=np.uint16):
+        super().__init__(size_max, size_min, state_dtype)
+        state_shape = tuple(state_shape)
+
+        # every column lives in a shared memory block that the actor processes attach to
+        self._layout = {
+            'states': ((size_max,) + state_shape, np.dtype(state_dtype)),
+            'actions': ((size_max,), np.dtype(np.int32)),
+            'rewards': ((size_max,), np.dtype(np.float32)),
+            'next_states': ((size_max,) + state_shape, np.dtype(state_dtype)),
+            'sequence': ((size_max,), np.dtype(np.uint64)),  # odd while the slot is being written
+        }
+        self._blocks = {column: shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * dtype.itemsize)
+                        for column, (shape, dtype) in self._layout.items()}
+        self._owner = True
+        self._map_columns()
+        self._sequence[:] = 0
+
+        # number of slots reserved so far, its lock is only held to reserve a slot, and number of samples
+        # completely written, created in the spawn context the rollout workers are started with
+        context = multiprocessing.get_context('spawn')
+        self._reserved = context.Value('q', 0)
+        self._committed = context.Value('q', 0)
+
+
+    def _map_columns(self):
+        """
+        View the shared memory blocks as numpy arrays
+        """
+        for column, (shape, dtype) in self._layout.items():
+            setattr(self, '_' + column, np.ndarray(shape, dtype=dtype, buffer=self._blocks[column].buf))
+
+
+    def __getstate__(self):
+        # sent to the actor processes when they are spawned: the block names, not their content
+        return {
+            'size_max': self._size_max,
+            'size_min': self._size_min,
+            'state_dtype': self._state_dtype,
+            'layout': self._layout,
+            'names': {column: block.name for column, block in self._blocks.items()},
+            'reserved': self._reserved,
+            'committed': self._committed,
+        }
+
+
+    def __setstate__(self, state):
+        Memory.__init__(self, state['size_max'], state['size_min'], state['state_dtype'])
+        self._layout = state['layout']
+        self._blocks = {column: shared_memory.SharedMemory(name=name) for column, name in state['names'].items()}
+        self._owner = False
+        self._map_columns()
+        self._reserved = state['reserved']
+        self._committed = state['committed']
+
+
+    def add_sample(self, sample):
+        """
+        Reserve the next slot and write the sample in place, concurrent actors only contend for the reservation.
+        The sequence number of the slot is odd during the write, so that a reader can tell a torn row
+        """
+        with self._reserved.get_lock():
+            index = self._reserved.value % self._size_max
+            self._reserved.value += 1
+
+        state, action, reward, next_state = sample
+        self._sequence[index] += 1
+        self._states[index] = state
+        self._actions[index] = action
+        self._rewards[index] = reward
+        self._next_states[index] = next_state
+        self._sequence[index] += 1
+
+        with self._committed.get_lock():
+            self._committed.value += 1
+
+
+    def get_samples(self, n, max_attempts=10):
+        """
+        Get n samples randomly from the committed slots, gathered straight from the shared blocks without
+        going through the workers. A slot that was being written, or was rewritten during the gather, is told
+        by its sequence number and replaced with another slot. None when n committed samples cannot be gathered
+        """
+        size = min(self._committed.value, self._size_max)
+        if size == 0 or size < self._size_min:
+            return None
+
+        n = min(n, size)
+        slots = min(self._reserved.value, self._size_max)
+        indices = self._rng.choice(slots, n, replace=False)
+
+        state_shape = self._layout['states'][0][1:]
+        states = np.empty((n,) + state_shape, dtype=np.float32)
+        next_states = np.empty((n,) + state_shape, dtype=np.float32)
+        actions = np.empty(n, dtype=np.int32)
+        rewards = np.empty(n, dtype=np.float32)
+
+        pending = np.arange(n)  # positions of the batch not gathered consistently yet
+        for _ in range(max_attempts):
+            gathered = indices[pending]
+            before = self._sequence[gathered]
+            states[pending], actions[pending], rewards[pending], next_states[pending] = self._batch(gathered)
+            consistent = (before > 0) & (before % 2 == 0) & (self._sequence[gathered] == before)
+
+            pending = pending[~consistent]
+            if len(pending) == 0:
+                return states, actions, rewards, next_states, indices, None
+
+            others = np.setdiff1d(np.arange(slots), indices)
+            if len(others) < len(pending):
+                break
+            indices[pending] = self._rng.choice(others, len(pending), replace=False)
+
+        return None
+
+
+    def _size_now(self):
+        return min(self._reserved.value, self._size_max)
+
+
+    def save(self, folder):
+        """
+        Write a snapshot of the committed slots, no slot is reserved meanwhile and the writes in progress are
+        waited for, so that every saved row is complete
+        """
+        os.makedirs(folder, exist_ok=True)
+        with self._reserved.get_lock():
+            while self._committed.value < self._reserved.value:
+                time.sleep(0.001)
+            self._index = self._reserved.value % self._size_max
+            self._size = min(self._reserved.value, self._size_max)
+            self._save(folder)
+
+
+    def _restore(self, folder, position):
+        size = position['size']
+        for name in COLUMNS:
+            if size:
+                getattr(self, '_' + name)[:size] = np.load(os.path.join(folder, name + '.npy'))
+        self._sequence[:size] = 2  # written once, the next write of a slot goes on from there
+
+        # the next reservation lands on the saved index
+        reserved = size if size < self._size_max else self._size_max + position['index']
+        with self._reserved.get_lock():
+            self._reserved.value = reserved
+            with self._committed.get_lock():
+                self._committed.value = reserved
+
+
+    def release(self):
+        """
+        Detach from the shared memory blocks, the process that created them also frees them
+        """
+        for column in self._layout:
+            setattr(self, '_' + column, None)  # the views must go before the blocks are closed
+        for block in self._blocks.values():
+            block.close()
+            if self._owner:
+                block.unlink()
@@ -11,14 +11,32 @@ from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.utils import plot_model
 from tensorflow.keras.models import load_model
 
+from inference import PRECISIONS, save_weights
+
 
 class TrainModel:
-    def __init__(self, num_layers, width, batch_size, learning_rate, input_dim, output_dim):
+    def __init__(self, num_layers, width, batch_size, learning_rate, input_dim, output_dim, jit_compile=False,
+                 heads=None):
         self._input_dim = input_dim
-        self._output_dim = output_dim
+        # a branching network has one head of q-values per intersection, heads being their numbers of phases,
+        # otherwise there is a single head with one q-value per action
+        self._heads = list(heads) if heads else [output_dim]
+        self._output_dim = sum(self._heads)
         self._batch_size = batch_size
         self._learning_rate = learning_rate
         self._model = self._build_model(num_layers, width)
+        self._loss = losses.Huber()
+        self._weights_version = 0  # changes whenever the weights do, so that cached predictions can be dropped
+
+        # one graph for any batch size, compiled with xla if asked
+        self._replay_step = tf.function(self._fused_replay_step, jit_compile=jit_compile, input_signature=[
+            tf.TensorSpec([None, input_dim], tf.float32),  # states
+            tf.TensorSpec([None], tf.int32),  # actions
+            tf.TensorSpec([None], tf.float32),  # rewards
+            tf.TensorSpec([None, input_dim], tf.float32),  # next states
+            tf.TensorSpec([], tf.float32),  # gamma
+            tf.TensorSpec([None], tf.float32),  # sample weights
+        ])
 
 
     def _build_model(self, num_layers, width):
@@ -30,10 +48,10 @@ class TrainModel:
 
         for _ in range(num_layers):
             x = layers.Dense(width, activation='relu')(x)
-        outputs = layers.Dense(self._output_dim, activation='linear')(x)
+        outputs = layers.Dense(self._output_dim, activation='linear')(x)  # the heads side by side when branching
 
         model = keras.Model(inputs=inputs, outputs=outputs, name='my_model')
-        model.compile(loss=tf.keras.losses.Huber(), optimizer=Adam(lr=self._learning_rate))
+        model.compile(loss=tf.keras.losses.Huber(), optimizer=Adam(learning_rate=self._learning_rate))
         return model
     
 
@@ -52,21 +70,108 @@ class TrainModel:
         return self._model.predict(states)
 
 
-    def train_batch(self, states, q_sa):
+    def train_batch(self, states, q_sa, sample_weight=None):
+        """
+        Train the nn using the updated q-values, optionally weighting the samples
+        """
+        self._model.fit(states, q_sa, sample_weight=sample_weight, epochs=1, verbose=0)
+        self._weights_version += 1
+
+
+    def replay_step(self, states, actions, rewards, next_states, gamma, sample_weight=None):
+        """
+        Train the nn towards the q-learning targets of a batch in a single compiled step, return the td errors
+        """
+        if sample_weight is None:
+            sample_weight = np.ones(len(actions), dtype=np.float32)
+
+        td_errors = self._replay_step(states, np.asarray(actions, dtype=np.int32), np.asarray(rewards, dtype=np.float32),
+                                      next_states, np.float32(gamma), sample_weight)
+        self._weights_version += 1
+        return td_errors.numpy()
+
+
+    def _fused_replay_step(self, states, actions, rewards, next_states, gamma, sample_weight):
+        """
+        Predict Q(state) and Q(next_state) in one forward pass, update Q(state, action) with the targets,
+        the Q(state) of the other actions are kept as they were predicted, then apply one gradient step.
+        With a branching network every head gets its own target for the phase of its intersection in the action,
+        and the td error of a sample is the mean over the heads
+        """
+        n = tf.shape(states)[0]
+        with tf.GradientTape() as tape:
+            q = self._model(tf.concat([states, next_states], axis=0), training=True)
+            q_s_a = q[:n]
+            q_s_a_d = tf.stop_gradient(q[n:])
+
+            q_s_a_targets, td_errors = [], []
+            start, radix = 0, int(np.prod(self._heads))
+            for size in self._heads:
+                radix //= size
+                head, head_d = q_s_a[:, start:start + size], q_s_a_d[:, start:start + size]
+                targets = rewards + gamma * tf.reduce_max(head_d, axis=1)
+
+                chosen = tf.one_hot(actions // radix % size, size, dtype=q_s_a.dtype)  # phase of the head's digit
+                q_s_a_targets.append(chosen * targets[:, None] + (1.0 - chosen) * head)
+                td_errors.append(targets - tf.reduce_sum(chosen * tf.stop_gradient(head), axis=1))
+                start += size
+
+            q_s_a_target = tf.stop_gradient(tf.concat(q_s_a_targets, axis=1))
+            loss = self._loss(q_s_a_target, q_s_a, sample_weight=sample_weight)
+
+        gradients = tape.gradient(loss, self._model.trainable_variables)
+        self._model.optimizer.apply_gradients(zip(gradients, self._model.trainable_variables))
+
+        return tf.reduce_mean(tf.stack(td_errors, axis=1), axis=1)
+
+
+    def get_weights(self):
         """
-        Train the nn using the updated q-values
+        Return the weights of the nn as a list of numpy arrays
         """
-        self._model.fit(states, q_sa, epochs=1, verbose=0)
+        return self._model.get_weights()
+
+
+    def set_weights(self, weights):
+        """
+        Replace the weights of the nn, e.g. with the ones of the model being trained
+        """
+        self._model.set_weights(weights)
+        self._weights_version += 1
 
 
     def save_model(self, path):
         """
-        Save the current model in the folder as h5 file and a model architecture summary as png
+        Save the current model in the folder as h5 file, its weights as npz files in every precision for the numpy
+        inference, and a model architecture summary as png
         """
         self._model.save(os.path.join(path, 'trained_model.h5'))
+        for precision in PRECISIONS:
+            save_weights(path, self._model.get_weights(), precision)
         plot_model(self._model, to_file=os.path.join(path, 'model_structure.png'), show_shapes=True, show_layer_names=True)
 
 
+    def save_checkpoint(self, folder):
+        """
+        Save the weights of the nn together with the state of its optimizer into the folder, to resume the training later
+        """
+        checkpoint = tf.train.Checkpoint(model=self._model, optimizer=self._model.optimizer)
+        checkpoint.write(os.path.join(folder, 'ckpt'))
+
+
+    def load_checkpoint(self, folder):
+        """
+        Resume from the checkpoint saved in the folder, return whether there was one
+        """
+        checkpoint_path = os.path.join(folder, 'ckpt')
+        if not os.path.isfile(checkpoint_path + '.index'):
+            return False
+
+        tf.train.Checkpoint(model=self._model, optimizer=self._model.optimizer).read(checkpoint_path).expect_partial()
+        self._weights_version += 1
+        return True
+
+
     @property
     def input_dim(self):
         return self._input_dim
@@ -77,11 +182,21 @@ class TrainModel:
         return self._output_dim
 
 
+    @property
+    def heads(self):
+        return self._heads
+
+
     @property
     def batch_size(self):
         return self._batch_size
 
 
+    @property
+    def weights_version(self):
+        return self._weights_version
+
+
 class TestModel:
     def __init__(self, input_dim, model_path):
         self._input_dim = input_dim
@@ -95,7 +210,7 @@ class TestModel:
         model_file_path = os.path.join(model_folder_path, 'trained_model.h5')
         
         if os.path.isfile(model_file_path):
-            loaded_model = load_model(model_file_path)
+            loaded_model = load_model(model_file_path, compile=False)  # only used for predictions
             return loaded_model
         else:
             sys.exit("Model number not found")
@@ -0,0 +1,137 @@
+import multiprocessing
+
+from generate_traffic import Traffic_Generator
+from Map import Map
+from scheduler import DecisionScheduler
+from utils import set_backend, set_sumo
+
+
+class EpisodeBuffer:
+    """
+    Memory of a rollout worker, it keeps the samples of one episode until they are sent to the central memory
+    """
+    def __init__(self):
+        self.samples = []
+
+    def add_sample(self, sample):
+        self.samples.append(sample)
+
+    def clear(self):
+        self.samples = []
+
+
+def worker_route_file(route_file, worker_id):
+    """
+    Route file of a worker, next to the one of the simulation
+    """
+    return route_file.replace('.rou.xml', '_worker' + str(worker_id) + '.rou.xml')
+
+
+def make_worker(worker_id, config, Model, Memory, label=None):
+    """
+    Build a Train simulating with its own sumo instance and route file, and storing its samples into Memory
+    """
+    from Train import Train
+
+    route_file = worker_route_file(config['route_file'], worker_id)
+    sumo_cmd = set_sumo(False, config['simulation_folder'], config['sumocfg_file_name'], config['max_steps'])
+    sumo_cmd += ['--route-files', route_file]
+
+    return Train(
+        Model,
+        Map(config['map']),
+        Memory,
+        Traffic_Generator(config['flow_file'], route_file, config['n_cars_generated'], config['simulation_time'],
+                          config['compact_routes'], config['direct_injection']),
+        sumo_cmd,
+        config['gamma'],
+        config['max_steps'],
+        config['green_duration'],
+        config['yellow_duration'],
+        config['num_states'],
+        config['num_actions'],
+        config['training_epochs'],
+        config['reuse_sumo'],
+        config['early_termination'],
+        label,
+        DecisionScheduler(config['skip_unchanged'], config['activity_threshold']),
+        config['branching']
+    )
+
+
+def _run_worker(worker_id, config, tasks, results, Memory):
+    """
+    Simulate the episodes sent by the parent with its own sumo instance, route file and model copy,
+    the samples are written into Memory when it is shared, otherwise they are sent back with the results
+    """
+    # imported here so that tensorflow is only loaded by the worker process itself
+    from model import TrainModel
+
+    set_backend(False, config['backend'])  # the worker process starts with the default backend
+
+    Model = TrainModel(
+        config['num_layers'],
+        config['width_layers'],
+        config['batch_size'],
+        config['learning_rate'],
+        input_dim=config['num_states'],
+        output_dim=config['num_actions'],
+        heads=Map(config['map']).phases if config['branching'] else None
+    )
+
+    Buffer = EpisodeBuffer() if Memory is None else Memory
+    Worker = make_worker(worker_id, config, Model, Buffer)
+
+    task = tasks.get()
+    while task is not None:
+        episode, epsilon, weights = task
+        Model.set_weights(weights)
+        if Memory is None:
+            Buffer.clear()
+        simulation_time = Worker.simulate(episode, epsilon)
+        samples = Buffer.samples if Memory is None else []
+        results.put((episode, samples, Worker.episode_stats, simulation_time))
+        task = tasks.get()
+
+    Worker.close()
+    if Memory is not None:
+        Memory.release()
+
+
+class RolloutPool:
+    def __init__(self, config, n_workers, Memory=None):
+        """
+        Memory is a SharedReplayMemory the workers write their samples into, or None to send them back
+        """
+        # spawn instead of fork, tensorflow and sumo connections do not survive a fork
+        context = multiprocessing.get_context('spawn')
+        self._tasks = [context.Queue() for _ in range(n_workers)]
+        self._results = context.Queue()
+        self._workers = [context.Process(target=_run_worker, args=(i, config, self._tasks[i], self._results, Memory),
+                                         daemon=True)
+                         for i in range(n_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def run(self, episodes, epsilons, weights):
+        """
+        Simulate one episode per worker in parallel with the given weights, return the results ordered by episode
+        """
+        for i, (episode, epsilon) in enumerate(zip(episodes, epsilons)):
+            self._tasks[i].put((episode, epsilon, weights))
+
+        results = [self._results.get() for _ in range(len(episodes))]
+        return sorted(results, key=lambda result: result[0])
+
+    def close(self):
+        """
+        Stop the workers and their sumo instances
+        """
+        for tasks in self._tasks:
+            tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    @property
+    def n_workers(self):
+        return len(self._workers)
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class DecisionScheduler:
+    """
+    Decide when the model has to be asked for an action: the previous action is kept, without any model call
+    or phase change, when the state did not change since the previous decision point or when fewer than
+    activity_threshold cars are halting
+    """
+    def __init__(self, skip_unchanged=False, activity_threshold=0):
+        self._skip_unchanged = skip_unchanged
+        self._activity_threshold = activity_threshold
+        self.reset()
+
+
+    def reset(self):
+        """
+        Forget the previous decision and the counters, at the beginning of an episode
+        """
+        self._last_state = None
+        self._last_action = None
+        self.taken = 0
+        self.skipped = 0
+
+
+    def skip(self, state):
+        """
+        Return whether the previous action can be kept for this state, counting the skipped decisions
+        """
+        state = np.asarray(state)
+        unchanged = self._last_state is not None and np.array_equal(state, self._last_state)
+        self._last_state = state
+
+        if self._last_action is not None and ((self._skip_unchanged and unchanged) or
+                                              state.sum() < self._activity_threshold):
+            self.skipped += 1
+            return True
+        return False
+
+
+    def record(self, action):
+        """
+        Remember the action the model chose, counting the decisions taken
+        """
+        self._last_action = action
+        self.taken += 1
+
+
+    def decide(self, state, choose_action):
+        """
+        Return the action for the state, calling choose_action(state) only when the previous one cannot be kept
+        """
+        if self.skip(state):
+            return self._last_action
+
+        action = choose_action(state)
+        self.record(action)
+        return action
+
+
+    @property
+    def last_action(self):
+        return self._last_action
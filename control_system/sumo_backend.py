@@ -0,0 +1,29 @@
+import traci as _traci
+
+
+class Backend:
+    """
+    Forward the TraCI API to the selected backend, traci talks to sumo through a socket while libsumo runs it in-process
+    """
+    def __init__(self):
+        self._module = _traci
+        self.name = 'traci'
+
+    def select(self, name):
+        """
+        Switch every module importing this backend to traci or libsumo
+        """
+        if name == 'libsumo':
+            import libsumo
+            self._module = libsumo
+        elif name == 'traci':
+            self._module = _traci
+        else:
+            raise ValueError("unknown sumo backend '%s', expected 'traci' or 'libsumo'" % name)
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._module, attr)
+
+
+traci = Backend()
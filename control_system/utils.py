@@ -1,8 +1,11 @@
 import configparser
 from sumolib import checkBinary
+import json
 import os
 import sys
 
+from sumo_backend import traci
+
 def set_path(path, sim_name, file):
     return path + "/" + sim_name + file
 
@@ -14,23 +17,45 @@ def import_train_configuration(config_file):
     content.read(config_file)
     config = {}
     config['gui'] = content['simulation'].getboolean('gui')
+    config['backend'] = content['simulation'].get('backend', 'traci')
     config['total_episodes'] = content['simulation'].getint('total_episodes')
     config['max_steps'] = content['simulation'].getint('max_steps')
     config['n_cars_generated'] = content['simulation'].getint('n_cars_generated')
     config['simulation_time'] = content['simulation'].getint('simulation_time')
+    config['compact_routes'] = content['simulation'].getboolean('compact_routes', False)
+    config['direct_injection'] = content['simulation'].getboolean('direct_injection', False)
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
+    config['reuse_sumo'] = content['simulation'].getboolean('reuse_sumo', False)
+    config['early_termination'] = content['simulation'].getboolean('early_termination', False)
+    config['skip_unchanged'] = content['simulation'].getboolean('skip_unchanged', False)
+    config['activity_threshold'] = content['simulation'].getint('activity_threshold', 0)
+    config['rollout_workers'] = content['simulation'].getint('rollout_workers', 1)
+    config['num_envs'] = content['simulation'].getint('num_envs', 1)
     config['num_layers'] = content['model'].getint('num_layers')
     config['width_layers'] = content['model'].getint('width_layers')
     config['batch_size'] = content['model'].getint('batch_size')
     config['learning_rate'] = content['model'].getfloat('learning_rate')
     config['training_epochs'] = content['model'].getint('training_epochs')
+    config['actor_learner'] = content['model'].getboolean('actor_learner', False)
+    config['sync_interval'] = content['model'].getint('sync_interval', 10)
+    config['jit_compile'] = content['model'].getboolean('jit_compile', False)
+    config['q_cache_size'] = content['model'].getint('q_cache_size', 0)
+    config['branching'] = content['model'].getboolean('branching', False)
     config['memory_size_min'] = content['memory'].getint('memory_size_min')
     config['memory_size_max'] = content['memory'].getint('memory_size_max')
+    config['prioritized'] = content['memory'].getboolean('prioritized', False)
+    config['shared_memory'] = content['memory'].getboolean('shared_memory', False)
+    config['alpha'] = content['memory'].getfloat('alpha', 0.6)
+    config['beta'] = content['memory'].getfloat('beta', 0.4)
     config['num_states'] = content['agent'].getint('num_states')
     config['num_actions'] = content['agent'].getint('num_actions')
     config['gamma'] = content['agent'].getfloat('gamma')
     config['models_path_name'] = content['dir']['models_path_name']
+    config['resume'] = content['dir'].getboolean('resume', False)
+
+    if config['prioritized'] and config['shared_memory']:
+        raise ValueError("prioritized and shared_memory cannot be combined, the shared memory samples uniformly")
 
     simulation_name = content['dir']['simulation_name']
 
@@ -53,14 +78,23 @@ def import_test_configuration(config_file):
     content.read(config_file)
     config = {}
     config['gui'] = content['simulation'].getboolean('gui')
+    config['backend'] = content['simulation'].get('backend', 'traci')
+    config['skip_unchanged'] = content['simulation'].getboolean('skip_unchanged', False)
+    config['activity_threshold'] = content['simulation'].getint('activity_threshold', 0)
     config['max_steps'] = content['simulation'].getint('max_steps')
     config['n_cars_generated'] = content['simulation'].getint('n_cars_generated')
     config['simulation_time'] = content['simulation'].getint('simulation_time')
+    config['compact_routes'] = content['simulation'].getboolean('compact_routes', False)
+    config['direct_injection'] = content['simulation'].getboolean('direct_injection', False)
     config['episode_seed'] = content['simulation'].getint('episode_seed')
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
     config['num_states'] = content['agent'].getint('num_states')
     config['num_actions'] = content['agent'].getint('num_actions')
+    config['inference'] = content['agent'].get('inference', 'numpy')
+    config['precision'] = content['agent'].get('precision', 'float32')
+    config['q_cache_size'] = content['agent'].getint('q_cache_size', 0)
+    config['branching'] = content['agent'].getboolean('branching', False)
 
     config['models_path_name'] = content['dir']['models_path_name']
     config['model_to_test'] = content['dir'].getint('model_to_test')
@@ -74,13 +108,25 @@ def import_test_configuration(config_file):
     config['flow_file'] = set_path(path, simulation_name, '_flow.json')
     config['route_file'] = set_path(path, simulation_name, '.rou.xml')
     config['map'] = set_path(path, simulation_name, "_map.json")
+    config['net_file'] = set_path(path, simulation_name, '.net.xml')
 
     return config
 
 
+def set_backend(gui, backend='traci'):
+    """
+    Select the sumo backend of the whole process, once at startup: libsumo runs sumo in-process and has no gui,
+    traci is used instead when the gui is requested
+    """
+    if gui and backend == 'libsumo':
+        backend = 'traci'
+    traci.select(backend)
+    return backend
+
+
 def set_sumo(gui, folder, sumocfg_file_name, max_steps):
     """
-    Configure various parameters of SUMO
+    Configure various parameters of SUMO, the backend running it is chosen beforehand with set_backend
     """
     # sumo things - we need to import python modules from the $SUMO_HOME/tools directory
     if 'SUMO_HOME' in os.environ:
@@ -102,9 +148,10 @@ def set_sumo(gui, folder, sumocfg_file_name, max_steps):
     return sumo_cmd
 
 
-def set_train_path(models_path_name):
+def set_train_path(models_path_name, resume=False):
     """
-    Create a new model path with an incremental integer, also considering previously created model paths
+    Create a new model path with an incremental integer, also considering previously created model paths,
+    when resuming the last model path is returned instead if its session is unfinished
     """
     models_path = os.path.join(os.getcwd(), models_path_name, '')
     os.makedirs(os.path.dirname(models_path), exist_ok=True)
@@ -112,6 +159,10 @@ def set_train_path(models_path_name):
     dir_content = os.listdir(models_path)
     if dir_content:
         previous_versions = [int(name.split("_")[1]) for name in dir_content]
+        last_path = os.path.join(models_path, 'model_' + str(max(previous_versions)), '')
+        session = load_session(last_path)
+        if resume and session is not None and not session['finished']:
+            return last_path
         new_version = str(max(previous_versions) + 1)
     else:
         new_version = '1'
@@ -121,6 +172,30 @@ def set_train_path(models_path_name):
     return data_path
 
 
+def load_session(path):
+    """
+    Read the session file of a model path, None if the training never saved one there
+    """
+    session_file = os.path.join(path, 'session.json')
+    if not os.path.isfile(session_file):
+        return None
+
+    with open(session_file) as file:
+        return json.load(file)
+
+
+def save_session(path, session):
+    """
+    Write the session file of a model path, through a temporary file so that an interruption keeps the previous one
+    """
+    session_file = os.path.join(path, 'session.json')
+    with open(session_file + '.tmp', 'w') as file:
+        json.dump(session, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(session_file + '.tmp', session_file)
+
+
 def set_test_path(models_path_name, model_n):
     """
     Returns a model path that identifies the model number provided as argument and a newly created 'test' path
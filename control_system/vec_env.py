@@ -0,0 +1,99 @@
+import timeit
+
+import numpy as np
+
+from rollout import make_worker
+from sumo_backend import traci
+
+
+def choose_actions(Model, states, epsilons, num_actions, rng, Map_info=None, branching=False):
+    """
+    Epsilon-greedy policy for a batch of states, the exploitative actions come from one forward pass,
+    composed from the best phase of every intersection when the model is branching
+    """
+    explore = rng.random(len(states)) < epsilons
+    actions = rng.integers(0, num_actions, len(states))  # random actions
+
+    if not explore.all():
+        q_values = Model.predict_batch(np.stack(states))
+        if branching:
+            greedy = Map_info.greedy_actions(q_values, branching=True)
+        else:
+            greedy = np.argmax(q_values, axis=1)  # the best actions given the states
+        actions = np.where(explore, actions, greedy)
+
+    return actions
+
+
+class VecTrain:
+    def __init__(self, config, Model, Memory, num_envs):
+        # libsumo runs a single simulation per process, several sumo instances need traci connections
+        if traci.name != 'traci':
+            raise ValueError("the lockstep environments need the traci backend, not " + traci.name)
+
+        self._Model = Model
+        self._num_actions = config['num_actions']
+        self._branching = config['branching']
+        self._rng = np.random.default_rng()
+        self._envs = [make_worker(i, config, Model, Memory, label='env' + str(i)) for i in range(num_envs)]
+
+    def run(self, episodes, epsilons):
+        """
+        Simulate one episode per environment in lockstep, all the actions of a decision are chosen together
+        """
+        start_time = timeit.default_timer()
+
+        envs = self._envs[:len(episodes)]
+        epsilons = np.asarray(epsilons)
+
+        for env, episode in zip(envs, episodes):
+            env.begin_episode(episode)
+
+        active = list(range(len(envs)))
+        while active:
+            states = []
+            deciding = []  # the environments whose scheduler does not keep the previous action
+            still_active = []
+            for i in active:
+                envs[i].activate()
+                state = envs[i].observe()
+                if envs[i].episode_done:
+                    envs[i].end_episode()
+                else:
+                    still_active.append(i)
+                    if not envs[i].scheduler.skip(state):
+                        states.append(state)
+                        deciding.append(i)
+
+            active = still_active
+            if not active:
+                break
+
+            if deciding:
+                actions = choose_actions(self._Model, states, epsilons[deciding], self._num_actions, self._rng,
+                                         envs[0].map_info, self._branching)
+                for i, action in zip(deciding, actions):
+                    envs[i].scheduler.record(action)
+
+            # like Train.simulate, an environment whose last action reached max_steps does not observe again
+            still_active = []
+            for i in active:
+                envs[i].activate()
+                envs[i].act(envs[i].scheduler.last_action)
+                if envs[i].episode_done:
+                    envs[i].end_episode()
+                else:
+                    still_active.append(i)
+            active = still_active
+
+        simulation_time = round(timeit.default_timer() - start_time, 1)
+
+        return [env.episode_stats for env in envs], simulation_time
+
+    def close(self):
+        for env in self._envs:
+            env.close()
+
+    @property
+    def num_envs(self):
+        return len(self._envs)